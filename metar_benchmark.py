@@ -0,0 +1,184 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import time_changed
+
+# Share of reports that carry each feature; "malformed" lines go through the special-case branch
+DEFAULT_MIX = {
+    "vrb": 0.10,            # VRBffKT winds
+    "calm": 0.05,           # 00000KT
+    "gust": 0.05,           # dddffGggKT
+    "rvr": 0.05,            # Rxx/.... runway visual range groups
+    "weather": 0.40,        # at least one weather group
+    "multi_weather": 0.10,  # a second weather group
+    "clouds": 0.70,         # one to three cloud layers, otherwise NSC
+    "negative_temp": 0.10,  # M temperatures / dew points
+    "malformed": 0.03,
+    "unavailable": 0.02,    # DATA UNAVAILABLE rows
+}
+
+WEATHER_GROUPS = ["HZ", "BR", "FG", "-RA", "RA", "+RA", "TSRA", "FU", "DZ", "SHRA", "VCTS", "BLDU", "MIFG", "BCFG", "DU"]
+CLOUD_AMOUNTS = ["FEW", "SCT", "BKN", "OVC"]
+VISIBILITIES = [50, 200, 800, 1200, 1500, 2000, 3000, 4000, 5000, 6000, 8000, 9999]
+RVR_GROUPS = ["R09/P1500", "R27/0800V1200U", "R09/1000N", "R27L/0550D"]
+# Each one breaks the report layout, so none of them matches the fast path
+MALFORMED_LINES = [
+    "METAR {station} {time} {wind} {vis} HZ NSC 15/08 QNH1012 NOSIG=",
+    "METAR {station} {time} {wind} CAVOK 12/M02 Q1020",
+    "METAR {station} {time} 250/05KT 4000 BR BKN020 10/08 Q101",
+    "METAR {station} {time} {wind} //// M01/M03",
+    "METAR {station} {time} {wind} {vis} NSC 2O/10 Q1009",
+]
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+RESULT_POLL_SECONDS = 5.0  # how often benchmark() checks that a size's process is still alive
+STAGES = ["read", "clean", "decode", "derive", "write"]
+
+
+def _temperature(value):
+    return f"M{-value:02d}" if value < 0 else f"{value:02d}"
+
+def _wind(rng, mix):
+    roll = rng.random()
+    if roll < mix["calm"]:
+        return "00000KT"
+    speed = rng.randint(1, 25)
+    direction = "VRB" if roll < mix["calm"] + mix["vrb"] else f"{rng.randrange(10, 370, 10):03d}"
+    if rng.random() < mix["gust"]:
+        return f"{direction}{speed:02d}G{speed + rng.randint(10, 20):02d}KT"
+    return f"{direction}{speed:02d}KT"
+
+def synthetic_metar(rng, report_time, station="VISR", mix=None):
+    """Builds one METAR line for report_time (UTC) with features drawn from mix."""
+    mix = {**DEFAULT_MIX, **(mix or {})}
+    stamp = report_time.strftime("%d%H%MZ")
+    wind = _wind(rng, mix)
+    visibility = f"{rng.choice(VISIBILITIES):04d}"
+
+    roll = rng.random()
+    if roll < mix["unavailable"]:
+        return f"METAR {station} {stamp} DATA UNAVAILABLE"
+    if roll < mix["unavailable"] + mix["malformed"]:
+        return rng.choice(MALFORMED_LINES).format(station=station, time=stamp, wind=wind, vis=visibility)
+
+    groups = ["METAR", station, stamp, wind, visibility]
+    if rng.random() < mix["rvr"]:
+        groups.append(rng.choice(RVR_GROUPS))
+    if rng.random() < mix["weather"]:
+        groups.append(rng.choice(WEATHER_GROUPS))
+        if rng.random() < mix["multi_weather"]:
+            groups.append(rng.choice(WEATHER_GROUPS))
+    if rng.random() < mix["clouds"]:
+        heights = sorted(rng.sample(range(5, 250), rng.randint(1, 3)))
+        groups.extend(f"{rng.choice(CLOUD_AMOUNTS)}{height:03d}" for height in heights)
+    else:
+        groups.append("NSC")
+
+    temp = rng.randint(-10, -1) if rng.random() < mix["negative_temp"] else rng.randint(0, 38)
+    dew_point = temp - rng.randint(0, 15)
+    groups.append(f"{_temperature(temp)}/{_temperature(dew_point)}")
+    groups.append(f"Q{rng.randint(990, 1035)}")
+    groups.append(rng.choice(["NOSIG", "NOSIG", "BECMG 2000 BR", "TEMPO 1500 BR", "240V300 NOSIG"]))
+    return " ".join(groups)
+
+def generate_metar_corpus(size, seed=0, mix=None, station="VISR", start=datetime(2023, 1, 1)):
+    """Returns a frame shaped like the Excel export: half-hourly local Timestamp and METAR Data."""
+    rng = random.Random(seed)
+    timestamps = [start + timedelta(minutes=30 * i) for i in range(size)]
+    lines = [
+        "METAR: " + synthetic_metar(rng, timestamp - timedelta(hours=5, minutes=30), station, mix)
+        for timestamp in timestamps
+    ]
+    return pd.DataFrame({"Timestamp": timestamps, "METAR Data": lines})
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_stages(input_file, output_file):
+    """Runs parse_metar_data on one input; returns seconds per stage and the row count."""
+    unparsed_file = os.path.join(os.path.dirname(output_file), "unparsed_metars.xlsx")
+    stats = time_changed.parse_metar_data(input_file, output_file, unparsed_file=unparsed_file)
+    timings = {stage: stats.timings.get(stage, 0.0) for stage in STAGES}
+    timings["decode"] = stats.timings.get("decode_fast", 0.0) + stats.timings.get("decode_fallback", 0.0)
+    return timings, stats.counts["rows"]
+
+def _benchmark_size(size, seed, input_format, output_format, workdir, results):
+    corpus = generate_metar_corpus(size, seed)
+    input_file = os.path.join(workdir, f"metar_{size}.{input_format}")
+    if input_format == "csv":
+        corpus.to_csv(input_file, index=False)
+    else:
+        corpus.to_excel(input_file, index=False)
+    del corpus
+
+    baseline_mb = _peak_rss_mb()
+    timings, rows = run_stages(input_file, os.path.join(workdir, f"decoded_{size}.{output_format}"))
+    results.put((timings, rows, baseline_mb, _peak_rss_mb()))
+
+def _child_result(process, results, size):
+    """Waits for a size's results; raises instead of hanging if its process dies (e.g. out of memory)."""
+    while process.exitcode is None:
+        try:
+            return results.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    # The process may have put its results just before exiting
+    try:
+        return results.get(timeout=RESULT_POLL_SECONDS)
+    except queue.Empty:
+        raise RuntimeError(f"Benchmark of {size} reports exited with code {process.exitcode}") from None
+
+def benchmark(sizes=DEFAULT_SIZES, seed=0, input_format="csv", output_format="csv"):
+    """Benchmarks each corpus size in a fresh process so peak memory is per size."""
+    context = multiprocessing.get_context("spawn")
+    report = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            results = context.Queue()
+            process = context.Process(
+                target=_benchmark_size, args=(size, seed, input_format, output_format, workdir, results)
+            )
+            process.start()
+            timings, rows, baseline_mb, peak_mb = _child_result(process, results, size)
+            process.join()
+
+            total = sum(timings.values())
+            report.append({
+                "reports": rows,
+                **{f"{stage}_s": round(timings[stage], 3) for stage in STAGES},
+                "total_s": round(total, 3),
+                "reports_per_s": round(rows / total) if total else 0,
+                "peak_mb": round(peak_mb, 1),
+                "pipeline_mb": round(peak_mb - baseline_mb, 1),
+            })
+            print(f"{rows} reports: {report[-1]['reports_per_s']} reports/s, peak {report[-1]['peak_mb']} MB")
+    return pd.DataFrame(report)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the METAR parser on synthetic corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--input-format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--output-format", choices=sorted(time_changed.OUTPUT_WRITERS), default="csv")
+    args = parser.parse_args(argv)
+
+    report = benchmark(args.sizes, args.seed, args.input_format, args.output_format)
+    print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import time_changed
+
+# Change since the report one lag earlier (within LAG_TOLERANCE of it)
+LAG_FEATURES = {
+    "QNH_Tendency_3h": ("QNH", timedelta(hours=3)),
+    "VV_Change_1h": ("VV", timedelta(hours=1)),
+    "RH_Change_1h": ("RH", timedelta(hours=1)),
+}
+# Mean over the reports in the window ending at (and including) each report
+ROLLING_FEATURES = {
+    "VV_Mean_3h": ("VV", timedelta(hours=3)),
+    "RH_Mean_3h": ("RH", timedelta(hours=3)),
+}
+LAG_TOLERANCE = timedelta(minutes=15)
+# Derived inputs are missing when a field they come from is, or when they fall outside their range
+DERIVED_INPUTS = {"RH": ("TTT", "TDTD")}
+INPUT_RANGES = {"RH": (0, 100)}
+# A fog spell ends at the first report without fog, or when reports stop for longer than this
+MAX_FOG_GAP = timedelta(minutes=90)
+FOG_PERSISTENCE = "Fog_Persistence"
+
+FEATURE_DTYPES = {
+    **{name: "int32" for name in LAG_FEATURES},
+    **{name: "float64" for name in ROLLING_FEATURES},
+    FOG_PERSISTENCE: "int32",
+}
+
+
+def _minutes(value):
+    return value // timedelta(minutes=1)
+
+
+class _StationHistory:
+    """The recent reports of one station: as far back as the longest lag or window reaches."""
+
+    def __init__(self, columns):
+        self.times = np.empty(0, np.int64)
+        self.values = {column: np.empty(0, np.float64) for column in columns}
+        self.fog = False
+        self.fog_since = 0
+
+
+class TemporalFeatures:
+    """Lag, rolling-window and persistence features, updated batch by batch.
+
+    update(df) takes decoded output frames in arrival order and returns them
+    with the FEATURE_DTYPES columns added. Each station keeps only the reports
+    its longest lag or window can reach, so a batch costs O(rows in the batch)
+    however long the history is. Per station the reports must arrive in time
+    order; a report not newer than the last one seen for its station is
+    counted in `late` and gets no features.
+
+    999 values (missing QNH, VV or RH) are left out of every mean and make
+    the lags that involve them 999; so is RH where TTT or TDTD is 999 or
+    where it lies outside 0-100 % (see DERIVED_INPUTS and INPUT_RANGES). A lag is 999 when no report lies within
+    LAG_TOLERANCE of the lagged time, so gaps are never bridged with older
+    values, and a window mean is taken over the reports actually in it (999
+    when there are none). Fog_Persistence is the time in minutes since the
+    current fog spell began, 0 without fog; fog is the decoder's
+    Fog_Indicator (any FG group, such as MIFG or BR FG, whatever WW is). Reports without a valid time
+    and DATA UNAVAILABLE rows get 999 everywhere and are not kept.
+    """
+
+    columns = list(FEATURE_DTYPES)
+
+    def __init__(self):
+        self.stations = {}
+        self.late = 0
+        self._inputs = sorted({column for column, _ in [*LAG_FEATURES.values(), *ROLLING_FEATURES.values()]})
+        self._horizon = max(
+            [_minutes(lag + LAG_TOLERANCE) for _, lag in LAG_FEATURES.values()]
+            + [_minutes(window) for _, window in ROLLING_FEATURES.values()]
+        )
+
+    def update(self, df):
+        features = {name: np.full(len(df), time_changed.MISSING, dtype) for name, dtype in FEATURE_DTYPES.items()}
+        times = df["DATETIME"].to_numpy().astype("datetime64[m]")
+        usable = ~np.isnat(times) & (df["Remark"] != time_changed.UNAVAILABLE_REMARK).to_numpy()
+        minutes = times.astype(np.int64)
+        values = {column: df[column].to_numpy(dtype=np.float64) for column in self._inputs}
+        for name, column in values.items():
+            missing = column == time_changed.MISSING
+            for source in DERIVED_INPUTS.get(name, ()):
+                missing |= (df[source] == time_changed.MISSING).to_numpy()
+            if name in INPUT_RANGES:
+                low, high = INPUT_RANGES[name]
+                missing |= (column < low) | (column > high)
+            column[missing] = np.nan
+        fog = (df["Fog_Indicator"] == 1).to_numpy()
+
+        # Rows of each station in time order; the sort is stable so equal times keep arrival order
+        codes, stations = pd.factorize(df["STATION"])
+        rows = np.flatnonzero(usable)
+        rows = rows[np.lexsort((minutes[rows], codes[rows]))]
+        bounds = np.flatnonzero(np.diff(codes[rows])) + 1
+        for block in np.split(rows, bounds) if len(rows) else []:
+            history = self.stations.setdefault(stations[codes[block[0]]], _StationHistory(self._inputs))
+            # Keep only reports newer than everything before them
+            previous = np.maximum.accumulate(np.concatenate([[history.times[-1] if len(history.times) else -1],
+                                                             minutes[block]]))[:-1]
+            fresh = minutes[block] > previous
+            self.late += int((~fresh).sum())
+            block = block[fresh]
+            if len(block):
+                self._update_station(history, minutes[block], {c: v[block] for c, v in values.items()},
+                                     fog[block], block, features)
+
+        return df.assign(**features)
+
+    def _update_station(self, history, times, values, fog, rows, features):
+        kept = len(history.times)
+        all_times = np.concatenate([history.times, times])
+        all_values = {column: np.concatenate([history.values[column], values[column]]) for column in values}
+
+        tolerance = _minutes(LAG_TOLERANCE)
+        for name, (column, lag) in LAG_FEATURES.items():
+            target = times - _minutes(lag)
+            # The latest report no later than the tolerance past the lagged time
+            found = np.searchsorted(all_times, target + tolerance, side="right") - 1
+            lagged = all_values[column][found.clip(0)]
+            change = values[column] - lagged
+            ok = (found >= 0) & (all_times[found.clip(0)] >= target - tolerance) & ~np.isnan(change)
+            features[name][rows] = np.where(ok, change, time_changed.MISSING)
+
+        end = kept + np.arange(len(times)) + 1
+        for name, (column, window) in ROLLING_FEATURES.items():
+            present = ~np.isnan(all_values[column])
+            sums = np.concatenate([[0.0], np.cumsum(np.where(present, all_values[column], 0.0))])
+            counts = np.concatenate([[0], np.cumsum(present)])
+            start = np.searchsorted(all_times, times - _minutes(window), side="right")
+            count = counts[end] - counts[start]
+            mean = (sums[end] - sums[start]) / np.maximum(count, 1)
+            features[name][rows] = np.where(count > 0, mean, time_changed.MISSING)
+
+        # Fog spells, continuing the one open at the end of the previous batch
+        previous_time = np.concatenate([all_times[kept - 1:kept] if kept else [times[0]], times[:-1]])
+        previous_fog = np.concatenate([[history.fog if kept else False], fog[:-1]])
+        continues = fog & previous_fog & (times - previous_time <= _minutes(MAX_FOG_GAP))
+        spell_start = np.maximum.accumulate(np.where(fog & ~continues, np.arange(len(times)), -1))
+        since = np.where(spell_start >= 0, times[spell_start.clip(0)], history.fog_since)
+        features[FOG_PERSISTENCE][rows] = np.where(fog, times - since, 0)
+        history.fog = bool(fog[-1])
+        history.fog_since = int(since[-1])
+
+        keep = all_times > times[-1] - self._horizon
+        history.times = all_times[keep]
+        history.values = {column: all_values[column][keep] for column in all_values}
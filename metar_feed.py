@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+import time_changed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_DELAY = 0.25    # seconds a report may wait for its batch to fill
+DEFAULT_QUEUE_SIZE = 10_000  # reports held between the sources and the decoder
+FRAME_QUEUE_SIZE = 4         # decoded batches waiting to be written
+RECONNECT_DELAY = 5.0
+HTTP_POLL_INTERVAL = 60.0
+TAIL_POLL_INTERVAL = 1.0
+LATENCY_WINDOW = 10_000      # most recent reports kept for the latency summary
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _report(line):
+    """Turns a raw feed line into (timestamp, cleaned line), or None for blank lines.
+
+    Lines may carry an Ogimet-style YYYYMMDDHHMM stamp; otherwise the receive
+    time (UTC) gives the year and month for the report's day.
+    """
+    line = line.strip()
+    stamp_match = time_changed.ARCHIVE_STAMP_PATTERN.match(line)
+    if stamp_match:
+        timestamp = datetime.strptime(stamp_match.group(1), "%Y%m%d%H%M")
+        line = line[stamp_match.end():]
+    else:
+        timestamp = _utc_now()
+    line = time_changed.clean_metar(line)
+    return (timestamp, line) if line else None
+
+
+async def tcp_source(host, port, reconnect_delay=RECONNECT_DELAY):
+    """Yields lines from a TCP feed, reconnecting when the connection drops.
+
+    Reading stops while the service queue is full, so a fast sender is held
+    back by TCP flow control instead of growing memory.
+    """
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as error:
+            if reconnect_delay is None:
+                raise
+            logger.warning("Cannot connect to %s:%s (%s); retrying in %ss", host, port, error, reconnect_delay)
+            await asyncio.sleep(reconnect_delay)
+            continue
+
+        logger.info("Connected to %s:%s", host, port)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                yield line.decode("utf-8", errors="replace")
+        finally:
+            writer.close()
+
+        if reconnect_delay is None:
+            return
+        logger.info("Feed %s:%s closed; reconnecting in %ss", host, port, reconnect_delay)
+        await asyncio.sleep(reconnect_delay)
+
+def _fetch(url, timeout):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read().decode("utf-8", errors="replace")
+
+async def http_source(url, interval=HTTP_POLL_INTERVAL, timeout=30.0):
+    """Polls an HTTP endpoint that lists the latest reports and yields lines not seen on the previous poll."""
+    loop = asyncio.get_running_loop()
+    seen = set()
+    while True:
+        try:
+            body = await loop.run_in_executor(None, _fetch, url, timeout)
+        except OSError as error:
+            logger.warning("Fetching %s failed: %s", url, error)
+        else:
+            lines = [line for line in body.splitlines() if line.strip()]
+            for line in lines:
+                if line not in seen:
+                    yield line
+            seen = set(lines)
+        await asyncio.sleep(interval)
+
+async def tail_source(path, interval=TAIL_POLL_INTERVAL, from_start=False):
+    """Yields lines appended to a text file, reopening it when it is truncated or rotated."""
+    handle = None
+    try:
+        while True:
+            if handle is None:
+                try:
+                    handle = open(path, "rb")
+                except FileNotFoundError:
+                    await asyncio.sleep(interval)
+                    continue
+                if not from_start:
+                    handle.seek(0, os.SEEK_END)
+                from_start = True  # a rotated file is read from its first line
+
+            position = handle.tell()
+            line = handle.readline()
+            if line.endswith(b"\n"):
+                yield line.decode("utf-8", errors="replace")
+                continue
+            # Nothing new, or a partial line the writer has not finished yet
+            handle.seek(position)
+
+            await asyncio.sleep(interval)
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if current.st_size < position or current.st_ino != os.fstat(handle.fileno()).st_ino:
+                handle.close()
+                handle = None
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+async def _put_end(queue, *consumers):
+    """Queues the end marker, unless a consumer stops (fails) first and the queue never drains."""
+    put = asyncio.ensure_future(queue.put(None))
+    await asyncio.wait([put, *consumers], return_when=asyncio.FIRST_COMPLETED)
+    put.cancel()
+
+
+class MetarFeedService:
+    """Decodes METAR reports from live sources into an output store.
+
+    sources are async iterables of raw lines (see tcp_source, http_source and
+    tail_source). Reports are batched - up to batch_size, or whatever arrived
+    within max_delay seconds - and decoded with the batch pipeline in a
+    worker thread (or a process pool with workers > 1), so the event loop
+    keeps reading. Both queues are bounded: when decoding or writing falls
+    behind, the sources stop reading. stations is the StationRegistry used
+    for elevation and local time; temporal_features (e.g.
+    metar_features.TemporalFeatures()) is updated with every decoded batch.
+    """
+
+    def __init__(self, sources, output_file, unparsed_file=None, output_format=None, workers=None,
+                 batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY, queue_size=DEFAULT_QUEUE_SIZE,
+                 stats=None, stations=None, temporal_features=None):
+        self.sources = list(sources)
+        self.output_file = output_file
+        self.unparsed_file = unparsed_file
+        self.output_format = output_format
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.stats = stats if stats is not None else time_changed.ParseStats()
+        self.stations = stations if stations is not None else time_changed.StationRegistry()
+        self.temporal_features = temporal_features
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._stop = None
+
+    def stop(self):
+        """Asks run() to finish: queued reports are still decoded and written."""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self):
+        """Runs until every source is exhausted or stop() is called; returns the ParseStats.
+
+        If decoding or writing fails, the sources are stopped, the writers
+        closed and the error is raised.
+        """
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        reports = asyncio.Queue(self.queue_size)
+        frames = asyncio.Queue(FRAME_QUEUE_SIZE)
+
+        columns = time_changed.OUTPUT_COLUMNS
+        if self.temporal_features is not None:
+            columns = columns + list(self.temporal_features.columns)
+        writer = time_changed.open_appender(self.output_file, columns, self.output_format)
+        unparsed_writer = None
+        if self.unparsed_file:
+            unparsed_writer = time_changed.open_appender(self.unparsed_file, ["METAR"])
+
+        # One thread each, so batches are decoded and written in arrival order. Pool
+        # processes are spawned, not forked, so they hold no copies of the feed sockets.
+        spawn = multiprocessing.get_context("spawn")
+        with ThreadPoolExecutor(1) as decode_thread, ThreadPoolExecutor(1) as write_thread, \
+                time_changed._decoding(self.workers, stats=self.stats, mp_context=spawn,
+                                       stations=self.stations) as decode:
+            decoding = asyncio.ensure_future(self._decode_batches(reports, frames, decode, decode_thread))
+            writing = asyncio.ensure_future(self._write_batches(frames, writer, unparsed_writer, write_thread))
+            pumps = [asyncio.ensure_future(self._pump(source, reports)) for source in self.sources]
+            sources_done = asyncio.gather(*pumps)
+            stopping = asyncio.ensure_future(self._stop.wait())
+            tasks = [sources_done, stopping, decoding, writing]
+            try:
+                # Decoding and writing only end early when they fail
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                sources_done.cancel()
+                stopping.cancel()
+                await asyncio.gather(sources_done, stopping, return_exceptions=True)
+                await _put_end(reports, decoding, writing)
+                await asyncio.wait([decoding, writing], return_when=asyncio.FIRST_EXCEPTION)
+                for task in (decoding, writing):
+                    if task.done():
+                        task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await loop.run_in_executor(write_thread, self._close, writer, unparsed_writer)
+
+        logger.info("Feed stopped; %s", self.stats)
+        return self.stats
+
+    async def _pump(self, source, reports):
+        try:
+            async for line in source:
+                report = _report(line)
+                if report is not None:
+                    await reports.put((time.perf_counter(), report))
+        except Exception:
+            logger.exception("Feed source %r failed", source)
+
+    async def _decode_batches(self, reports, frames, decode, decode_thread):
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            item = await reports.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                if reports.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(reports.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = reports.get_nowait()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+
+            received = [received_at for received_at, _ in batch]
+            df_output, unmatched_metars = await loop.run_in_executor(
+                decode_thread, self._decode, decode, [report for _, report in batch]
+            )
+            await frames.put((df_output, unmatched_metars, received))
+        await frames.put(None)
+
+    def _decode(self, decode, reports):
+        df_output, unmatched_metars = decode(reports)
+        if self.temporal_features is not None:
+            with self.stats.timer("features"):
+                df_output = self.temporal_features.update(df_output)
+        return df_output, unmatched_metars
+
+    async def _write_batches(self, frames, writer, unparsed_writer, write_thread):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await frames.get()
+            if item is None:
+                return
+            df_output, unmatched_metars, received = item
+            await loop.run_in_executor(write_thread, self._write, writer, unparsed_writer, df_output,
+                                       unmatched_metars)
+            written_at = time.perf_counter()
+            self.latencies.extend(written_at - received_at for received_at in received)
+
+    def _write(self, writer, unparsed_writer, df_output, unmatched_metars):
+        with self.stats.timer("write"):
+            writer.append(df_output)
+            if unmatched_metars and unparsed_writer is not None:
+                unparsed_writer.append(pd.DataFrame({"METAR": unmatched_metars}))
+
+    def _close(self, writer, unparsed_writer):
+        with self.stats.timer("write"):
+            writer.close()
+            if unparsed_writer is not None:
+                unparsed_writer.close()
+
+    def latency_summary(self):
+        """Receive-to-written latency in seconds over the most recent reports."""
+        if not self.latencies:
+            return {}
+        ordered = sorted(self.latencies)
+        return {
+            "reports": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": ordered[len(ordered) // 2],
+            "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            "max": ordered[-1],
+        }
+
+
+async def start_stand_in_feed(stations=300, reports=20, interval=0.1, host="127.0.0.1", port=0, seed=0):
+    """Starts a local TCP server that stands in for a live feed.
+
+    Each connection is one station: it receives `reports` synthetic METARs,
+    one every `interval` seconds, and is then closed. Returns the server and
+    the station codes; connect to server.sockets[0].getsockname()[1].
+    """
+    import metar_benchmark
+
+    rng = random.Random(seed)
+    codes = ["V" + "".join(letters) for letters in itertools.islice(
+        itertools.product("ABCDEFGHIJKLMNOPQRSTUVWXYZ", repeat=3), stations)]
+    pending = deque(codes)
+
+    async def handle(reader, writer):
+        station = pending.popleft() if pending else rng.choice(codes)
+        start = _utc_now().replace(second=0, microsecond=0)
+        try:
+            for i in range(reports):
+                report_time = start - timedelta(minutes=30 * (reports - i))
+                line = metar_benchmark.synthetic_metar(rng, report_time, station)
+                writer.write(f"{report_time:%Y%m%d%H%M} {line}\n".encode())
+                await writer.drain()
+                await asyncio.sleep(interval)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, backlog=max(100, stations))
+    return server, codes
+
+def _host_port(value):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+async def _serve(args):
+    sources = [tcp_source(*_host_port(address)) for address in args.tcp]
+    sources += [http_source(url, args.poll_interval) for url in args.http]
+    sources += [tail_source(path) for path in args.tail]
+
+    server = None
+    if args.stand_in:
+        server, _ = await start_stand_in_feed(args.stand_in)
+        port = server.sockets[0].getsockname()[1]
+        sources += [tcp_source("127.0.0.1", port, reconnect_delay=None) for _ in range(args.stand_in)]
+    if not sources:
+        raise SystemExit("No feed sources given (use --tcp, --http, --tail or --stand-in)")
+
+    stations = time_changed.StationRegistry.from_csv(args.stations) if args.stations else None
+    temporal_features = None
+    if args.temporal_features:
+        import metar_features
+
+        temporal_features = metar_features.TemporalFeatures()
+    service = MetarFeedService(sources, args.output, args.unparsed, args.format, args.workers,
+                               args.batch_size, args.max_delay, stations=stations,
+                               temporal_features=temporal_features)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, service.stop)
+    except (NotImplementedError, RuntimeError):  # Windows event loops
+        pass
+    try:
+        await service.run()
+    finally:
+        if server is not None:
+            server.close()
+    latency = service.latency_summary()
+    if latency:
+        logger.info("Latency over %d reports: mean %.3fs, p50 %.3fs, p99 %.3fs, max %.3fs",
+                    latency["reports"], latency["mean"], latency["p50"], latency["p99"], latency["max"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode live METAR feeds into an output file.")
+    parser.add_argument("output", help="output file; .csv or .parquet are readable while the feed runs")
+    parser.add_argument("--tcp", action="append", default=[], metavar="HOST:PORT")
+    parser.add_argument("--http", action="append", default=[], metavar="URL")
+    parser.add_argument("--tail", action="append", default=[], metavar="PATH")
+    parser.add_argument("--stand-in", type=int, default=0, metavar="STATIONS",
+                        help="also run a local synthetic feed with this many stations")
+    parser.add_argument("--stations", default=None, help="station registry CSV (ICAO, ELEVATION, UTC_OFFSET)")
+    parser.add_argument("--unparsed", default=None, help="file for reports without the full METAR layout")
+    parser.add_argument("--format", choices=sorted(time_changed.OUTPUT_WRITERS), default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--temporal-features", action="store_true",
+                        help="add lag, rolling-window and fog persistence columns (see metar_features)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY)
+    parser.add_argument("--poll-interval", type=float, default=HTTP_POLL_INTERVAL)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(_serve(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import time_changed
+
+# Aggregations used by ObservationStore.resample; 999 sentinels are left out of every statistic
+DEFAULT_AGGREGATIONS = {
+    "TTT": "mean",
+    "TDTD": "mean",
+    "RH": "mean",
+    "QNH": "mean",
+    "QFE": "mean",
+    "FF": "mean",
+    "VV": "min",
+    "Low_Visibility_Indicator": "sum",
+}
+
+RESAMPLE_FREQUENCIES = {"hourly": "h", "daily": "D"}
+
+
+class ObservationStore:
+    """Decoded observations behind a sorted time index, per station and overall.
+
+    Rows are kept sorted by station, then time, so each station is one
+    contiguous block; a time order over all stations is kept alongside.
+    Range lookups are two binary searches plus the rows returned; filters on
+    WW, VV, Low_Visibility_Indicator and Fog_Indicator only look at the rows
+    in range.
+    Hourly and daily aggregates are computed once per station and cached,
+    so later windows are slices of the cached result.
+
+    Example, last January's fog hours at VISR:
+        fog = store.query("2024-01-01", "2024-02-01", station="VISR", fog=True)
+        fog["DATETIME"].dt.floor("h").nunique()
+    """
+
+    def __init__(self, df):
+        # Reports without a valid time cannot be placed on the index
+        df = df[df["DATETIME"].notna()]
+        if "STATION" not in df.columns:
+            df = df.assign(STATION="")
+        codes, station_index = np.unique(df["STATION"].to_numpy(dtype=object), return_inverse=True)
+        order = np.lexsort((df["DATETIME"].to_numpy(), station_index))
+        self.frame = df.iloc[order].reset_index(drop=True)
+        times = self.frame["DATETIME"].to_numpy()
+
+        # Each station's block of rows: (first row, times within the block)
+        bounds = np.searchsorted(station_index[order], np.arange(len(codes) + 1))
+        self.station_blocks = {
+            code: (bounds[i], times[bounds[i]:bounds[i + 1]]) for i, code in enumerate(codes)
+        }
+        self.time_order = np.argsort(times, kind="stable")
+        self.times = times[self.time_order]
+        self._aggregates = {}
+
+    @classmethod
+    def from_output(cls, path, output_format=None, stations=None):
+        """Loads an output file, or a partitioned output directory (optionally only some stations).
+
+        Without output_format, the format comes from the file extension or from the part files.
+        """
+        if not os.path.isdir(path):
+            return cls(time_changed.read_output(path, output_format))
+
+        frames = []
+        for station in sorted(os.listdir(path)):
+            if stations is not None and station not in stations:
+                continue
+            for month in sorted(os.listdir(os.path.join(path, station))):
+                year, month = (int(part) for part in month.split("-"))
+                frames.append(time_changed.read_partition(path, station, year, month, output_format))
+        if not frames:
+            return cls(pd.DataFrame(columns=time_changed.OUTPUT_COLUMNS).astype(time_changed.OUTPUT_DTYPES))
+        return cls(pd.concat(frames, ignore_index=True))
+
+    @property
+    def stations(self):
+        return list(self.station_blocks)
+
+    def range(self, start=None, end=None, station=None):
+        """Observations with start <= DATETIME < end, in time order."""
+        if station is None:
+            lo, hi = _bounds(self.times, start, end)
+            return self.frame.iloc[self.time_order[lo:hi]]
+        if station not in self.station_blocks:
+            return self.frame.iloc[:0]
+        first_row, times = self.station_blocks[station]
+        lo, hi = _bounds(times, start, end)
+        return self.frame.iloc[first_row + lo:first_row + hi]
+
+    def query(self, start=None, end=None, station=None, ww=None, max_visibility=None, low_visibility=None,
+              fog=None):
+        """Observations in [start, end) matching every filter given.
+
+        ww is one WW code or weather group name ("FG") or a list of them; WW
+        holds a single code per report, so use fog to find every report with
+        a fog group. max_visibility keeps reports with VV at or below it;
+        low_visibility and fog select on Low_Visibility_Indicator and
+        Fog_Indicator.
+        """
+        df = self.range(start, end, station)
+        mask = np.ones(len(df), dtype=bool)
+        if ww is not None:
+            codes = [time_changed.WEATHER_CODE_MAP.get(code, code) for code in _as_list(ww)]
+            mask &= df["WW"].isin(codes).to_numpy()
+        if max_visibility is not None:
+            visibility = df["VV"].to_numpy()
+            mask &= (visibility <= max_visibility) & (visibility != time_changed.MISSING)
+        if low_visibility is not None:
+            mask &= df["Low_Visibility_Indicator"].to_numpy() == int(low_visibility)
+        if fog is not None:
+            mask &= df["Fog_Indicator"].to_numpy() == int(fog)
+        return df[mask]
+
+    def resample(self, freq="hourly", start=None, end=None, station=None, aggregations=None):
+        """Hourly or daily aggregates (or any pandas frequency) for [start, end).
+
+        Each bin also gets "reports", the number of observations in it; bins
+        without reports are left out. The whole series for (station, freq,
+        aggregations) is computed on first use and cached.
+        """
+        freq = RESAMPLE_FREQUENCIES.get(freq, freq)
+        aggregations = aggregations or DEFAULT_AGGREGATIONS
+        key = (station, freq, tuple(aggregations.items()))
+        if key not in self._aggregates:
+            self._aggregates[key] = _aggregate(self.range(station=station), freq, aggregations)
+        aggregate = self._aggregates[key]
+
+        lo, hi = _bounds(aggregate.index.to_numpy(), start, end)
+        return aggregate.iloc[lo:hi]
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+def _bounds(times, start, end):
+    """Positions of [start, end) in sorted datetime64 times; None leaves that side open."""
+    lo = 0 if start is None else np.searchsorted(times, pd.Timestamp(start).to_datetime64().astype(times.dtype))
+    hi = len(times) if end is None else np.searchsorted(times, pd.Timestamp(end).to_datetime64().astype(times.dtype))
+    return lo, hi
+
+def _aggregate(df, freq, aggregations):
+    columns = list(aggregations)
+    values = df[columns].astype(np.float64)
+    values = values.where(values != time_changed.MISSING)
+    bins = df["DATETIME"].dt.floor(freq)
+    grouped = values.groupby(bins)
+    result = grouped.agg(aggregations)
+    result["reports"] = grouped.size()
+    result.index.name = "DATETIME"
+    return result
@@ -0,0 +1,60 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import metar_benchmark
+import metar_feed
+
+STATIONS = 20
+REPORTS = 5
+
+
+async def _run_against_stand_in(output_file):
+    server, codes = await metar_feed.start_stand_in_feed(STATIONS, reports=REPORTS, interval=0.01)
+    try:
+        port = server.sockets[0].getsockname()[1]
+        sources = [metar_feed.tcp_source("127.0.0.1", port, reconnect_delay=None) for _ in codes]
+        service = metar_feed.MetarFeedService(sources, output_file, batch_size=32, max_delay=0.05)
+        stats = await asyncio.wait_for(service.run(), timeout=60)
+    finally:
+        server.close()
+        await server.wait_closed()
+    return codes, stats
+
+
+def test_service_writes_every_stand_in_report(tmp_path):
+    output_file = str(tmp_path / "feed.csv")
+    codes, stats = asyncio.run(_run_against_stand_in(output_file))
+
+    output = pd.read_csv(output_file, parse_dates=["DATETIME"])
+    assert len(output) == STATIONS * REPORTS
+    assert stats.counts["rows"] == STATIONS * REPORTS
+    assert sorted(output["STATION"].unique()) == sorted(codes)
+    assert (output.groupby("STATION").size() == REPORTS).all()
+    # Each station's reports are written in the order it sent them, 30 minutes apart
+    for _, reports in output.groupby("STATION"):
+        assert (reports["DATETIME"].diff().dropna() == pd.Timedelta(minutes=30)).all()
+
+
+class _FailingFeatures:
+    columns = []
+
+    def update(self, df):
+        raise RuntimeError("feature stage failed")
+
+
+async def _synthetic_source(reports):
+    rng = random.Random(0)
+    for i in range(reports):
+        yield metar_benchmark.synthetic_metar(rng, datetime(2023, 1, 1) + timedelta(minutes=30 * i))
+
+
+def test_service_raises_when_decoding_fails(tmp_path):
+    # More reports than the queue holds, so the source is blocked when decoding fails
+    service = metar_feed.MetarFeedService([_synthetic_source(20_000)], str(tmp_path / "feed.csv"),
+                                          queue_size=100, temporal_features=_FailingFeatures())
+    with pytest.raises(RuntimeError, match="feature stage failed"):
+        asyncio.run(asyncio.wait_for(service.run(), timeout=30))
@@ -0,0 +1,104 @@
+import json
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import time_changed
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+FIXTURE = os.path.join(TEST_DATA, "fixture.xlsx")
+# Output of the original row-by-row parse_metar_data on FIXTURE
+EXPECTED = os.path.join(TEST_DATA, "fixture_expected.xlsx")
+EXPECTED_UNPARSED = os.path.join(TEST_DATA, "fixture_expected_unparsed.xlsx")
+# Fixture, synthetic and randomly mutated lines with the fields the regex decoder
+# (before the group tokenizer) gave them; lines it could not decode are left out
+DECODER_CORPUS = os.path.join(TEST_DATA, "decoder_corpus.jsonl")
+
+
+def _as_text(column):
+    return column.astype(str).where(column.notna(), "")
+
+
+@pytest.fixture(scope="module")
+def parsed(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("parsed")
+    output_file = str(directory / "out.xlsx")
+    unparsed_file = str(directory / "unparsed.xlsx")
+    time_changed.parse_metar_data(FIXTURE, output_file, unparsed_file=unparsed_file)
+    return pd.read_excel(output_file), pd.read_excel(unparsed_file)
+
+
+def test_output_matches_baseline(parsed):
+    output, _ = parsed
+    expected = pd.read_excel(EXPECTED)
+    # Deliberate changes since the baseline: DDD is numeric (VRB is 999), and
+    # 282130Z read on 1 March 2023 rolls back to 28 February, not a 29th.
+    expected["DDD"] = expected["DDD"].replace("VRB", time_changed.MISSING).astype(int)
+    expected.loc[400, "DD"] = 1
+    # DATETIME is a timestamp. The baseline kept the reference month for reports
+    # from the previous month (rows 0-9 are 31 December UTC), which are now rolled back.
+    expected["DATETIME"] = pd.to_datetime(expected["DATETIME"], format="%d-%m-%Y %H.%M")
+    expected.loc[0:9, "DATETIME"] = pd.date_range("2023-01-01 00:30", periods=10, freq="30min")
+    expected.loc[400, "DATETIME"] = pd.Timestamp("2023-03-01 03:00")
+    expected.loc[401, "DATETIME"] = pd.Timestamp("2023-04-01 03:00")
+    assert list(output.columns) == time_changed.OUTPUT_COLUMNS
+    # STATION before and Fog_Indicator after the baseline columns, which keep their order
+    assert list(output.columns[1:1 + len(expected.columns)]) == list(expected.columns)
+    assert len(output) == len(expected)
+    for column in expected.columns:
+        if expected[column].dtype.kind in "fM":
+            pd.testing.assert_series_equal(output[column], expected[column], check_dtype=False, rtol=0, atol=1e-9)
+        else:
+            pd.testing.assert_series_equal(_as_text(output[column]), _as_text(expected[column]))
+
+
+def test_unparsed_matches_baseline(parsed):
+    _, unparsed = parsed
+    pd.testing.assert_frame_equal(unparsed, pd.read_excel(EXPECTED_UNPARSED))
+
+
+def test_process_pool_matches_serial_run(parsed, tmp_path):
+    output_file = str(tmp_path / "out.xlsx")
+    unparsed_file = str(tmp_path / "unparsed.xlsx")
+    time_changed.parse_metar_data(FIXTURE, output_file, unparsed_file=unparsed_file, workers=2)
+    output, unparsed = parsed
+    pd.testing.assert_frame_equal(pd.read_excel(output_file), output)
+    pd.testing.assert_frame_equal(pd.read_excel(unparsed_file), unparsed)
+
+
+def test_decode_cache_serves_repeated_runs(parsed, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / "cache.sqlite")
+    outputs = []
+    for run, expected_counts in enumerate([(0, 402), (402, 0)]):
+        output_file = str(tmp_path / f"out{run}.xlsx")
+        stats = time_changed.parse_metar_data(FIXTURE, output_file, unparsed_file=str(tmp_path / f"unparsed{run}.xlsx"),
+                                              cache_path=cache_path)
+        assert (stats.counts["cache_hits"], stats.counts["cache_misses"]) == expected_counts
+        outputs.append(pd.read_excel(output_file))
+    pd.testing.assert_frame_equal(outputs[0], parsed[0])
+    pd.testing.assert_frame_equal(outputs[1], parsed[0])
+
+    # A cache filled by another decoder version is emptied when it is opened
+    monkeypatch.setattr(time_changed, "DECODER_VERSION", time_changed.DECODER_VERSION + 1)
+    time_changed.DecodeCache(cache_path).close()
+    connection = sqlite3.connect(cache_path)
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM decoded").fetchone()[0] == 0
+        assert connection.execute("PRAGMA user_version").fetchone()[0] == time_changed.DECODER_VERSION
+    finally:
+        connection.close()
+
+
+def test_decoder_matches_regex_decoder_on_corpus():
+    decoder = time_changed.MetarDecoder()
+    with open(DECODER_CORPUS) as corpus:
+        cases = [json.loads(line) for line in corpus]
+    mismatches = []
+    for case in cases:
+        fields, matched = decoder.decode_fields(case["metar"])
+        decoded = {name: getattr(fields, name) for name in case["fields"]}
+        if (decoded, matched) != (case["fields"], case["matched"]):
+            mismatches.append((case["metar"], decoded, case["fields"]))
+    assert not mismatches, f"{len(mismatches)} of {len(cases)} lines differ, e.g. {mismatches[:3]}"
@@ -1,462 +1,1469 @@
-import pandas as pd
-import numpy as np
-import re
-import math
-import calendar
-from datetime import datetime, timedelta
-
-# def parse_visibility(value):
-#     """Parses visibility value, ensuring it's a valid number."""
-#     if value.isdigit():
-#         return int(value)
-#     elif value in ['KT', 'MPS', 'VRB']:
-#         return 999  # For invalid visibility, return a default value (999)
-#     return int(value)  # Fallback for other valid formats
-# # def parse_wind(value):
-#     """Parses wind value, ensuring it's a valid number."""
-#     if value.isdigit():
-
-def parse_temp(value):
-    """Parses temperature values, handling 'M' for negative values."""
-    if value.startswith("M"):
-        return -int(value[1:]) if value[1:] != "00" else 0  # Convert "M00" to 0
-    return int(value)
-
-def is_leap_year(year):
-    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
-
-def parse_metar_data(input_file, output_file):
-
-    df_input = pd.read_excel(input_file)
-
-    df_input['Timestamp'] = pd.to_datetime(df_input['Timestamp'])  # Ensures it’s datetime format
-
-    df_input['Timestamp'] = pd.to_datetime(df_input['Timestamp'], format='%d-%m-%Y %I.%M.%S %p', errors='coerce')
-
-    # Clean METAR Data
-    df_input['Cleaned_METAR'] = df_input['METAR Data'].apply(
-        lambda x: re.sub(r"\s*METAR:\s*", "", str(x)).strip() if pd.notnull(x) else ""
-    )
-
-    for index, row in df_input.iterrows():
-    
-        timestamp = row['Timestamp']
-
-        metar_line = row['METAR Data']
-        
-        metar_lines = df_input[['Timestamp', 'Cleaned_METAR']].dropna().values.tolist()
-
-        pattern = (
-        r"METAR (\w+) (\d{6}Z) "
-        r"(?:(\d{3}|VRB)(\d{2})(G\d{2,3})?(KT|MPS|KMH)|00000KT) "
-        r"(?:(\d{4}))? "  # Visibility
-        r"(?:R\d{2}[LRC]?/P?M?\d+(?:V\d+)?(?:[UDN])?\s*)?"  # Runway info
-        r"((?:\w{2,6}\s?)*)"  # Weather phenomena (like BR, HZ, etc.)
-        r"(?:(?:SKC|FEW|SCT|BKN|OVC|NSC)\d{3}\s?)* "  # Cloud information 
-        r"(-?\d+|M\d+)/(-?\d+|M\d+) "  # Temperature/Dew point
-        r"Q(\d+)"  # QNH
-        r"(?:\s*\d{3}V\d{3})?"  # Variable wind direction
-        r"(?:\s*(.*))"  # Remaining remarks
-        )
-
-        data_list = []
-
-        unmatched_metars = []
-
-        for timestamp,metar_line in metar_lines:
-            # Ignore Rxx/Pxxxx if present
-            metar_line = re.sub(r"R\d{2}/P\d+", "", metar_line)
-
-            # Extract date-time part
-            date_time_match = re.search(r"(\d{6}Z)", metar_line)
-            date_time_raw = date_time_match.group(1) if date_time_match else "999999Z"
-            
-            year = timestamp.year
-            month = timestamp.month
-
-            # Convert to readable format
-            day = int(date_time_raw[:2])
-            hour = int(date_time_raw[2:4])
-            minute = int(date_time_raw[4:6])
-
-            # Handle date validation - IMPORTANT FIX
-            try:
-                # Try creating the datetime with the month from the timestamp
-                original_time = datetime(year, month, day, hour, minute)
-            except ValueError:
-                # If that fails, try using the previous or next month
-                print(f"Date validation error for {day} in month {month}. Trying alternative month.")
-
-                if month == 2:
-                    if not is_leap_year(year) and day > 28:  # Non-leap year
-                        day = 28
-                    elif is_leap_year(year) and day > 29:  # Leap year
-                        day = 29
-
-                elif month in [4, 6, 9, 11] and day > 30:  # Months with 30 days
-                    day = 30
-
-                elif month in [1, 3, 5, 7, 8, 10, 12] and day > 31:  # Months with 31 days
-                    day = 31
-
-                elif day > 31:  # Fallback (invalid date for any month)
-                    day = 28  # Safe fallback
-                try:
-                    original_time = datetime(year, month, day, hour, minute)
-                except ValueError:
-                    # If still failing, use the current date from timestamp
-                    print(f"Still having issues with date {day}-{month}-{year}, using timestamp date instead")
-                    original_time = datetime(timestamp.year, timestamp.month, timestamp.day, hour, minute)
-            
-            adjusted_time = original_time + timedelta(hours=5, minutes=30)
-            formatted_datetime = adjusted_time.strftime("%d-%m-%Y %H.%M")
-            time_24hr = adjusted_time.strftime("%H:%M")
-
-            # Handle "DATA UNAVAILABLE" case
-            if "DATA UNAVAILABLE" in metar_line:
-                print(f"Filling missing data for: {metar_line}")
-                data_list.append({
-                    "DATETIME": formatted_datetime, "YEAR": year, "MONTH": month, "DD": adjusted_time.day, "GGGG": time_24hr,
-                    "DDD": 999, "FF": 999, "VV": 999, "WW": 999, "N": 999, "TTT": 999, "TDTD": 999, "RH": 999,
-                    "QFE": 999, "QNH": 999, "U": 999, "V": 999, "Wx": 999, "Wy": 999, "Low_Visibility_Indicator": 999,
-                    "Daylight_Indicator": 999, "Dew_Point_Depression": 999, "Remark": "DATA UNAVAILABLE"
-                })
-                continue  
-
-            match = re.match(pattern, metar_line)
-            if match:
-                station = match.group(1)
-                wind_direction = match.group(3) if match.group(3) else "000"
-                wind_speed = int(match.group(4)) if match.group(4) else 0
-                wind_gust = int(match.group(5)[1:]) if match.group(5) else 0
-                visibility = int(match.group(7))
-
-                weather_code_map = {
-                    "BR": 10,   # Mist
-                    "HZ": 5,    # Haze
-                    "DU": 7,    # Widespread Dust
-                    "FU": 4,    # Smoke
-                    "BLDU": 9,  # Blowing Widespread Dust
-                    "DZ": 50,   # Drizzle
-                    "RA": 21,   # Rain
-                    "SN": 22,   # Snow
-                    "SG": 20,   # Snow Grains
-                    "IC": 15,   # Ice Crystals NN
-                    "PL": 79,   # Ice Pellets
-                    "GR": 27,   # Hail
-                    "GS": 87,   # Small Hail and/or Snow Pellets
-                    "UP": 19,   # Unknown Precipitation NN
-                    "FG": 28,   # Fog
-                    "VA": 4,   # Volcanic Ash
-                    "SA": 22,   # Sand
-                    "SS": 23,   # Sandstorm
-                    "DS": 24,   # Duststorm
-                    "PO": 8,   # Dust/Sand Whirls
-                    "SQ": 18,   # Squalls
-                    "FC": 19,   # Funnel Clouds
-                    "TS": 29,   # Thunderstorm
-                    "SH": 70,   # Showers
-                    "FZ": 24,   # Freezing
-                    "DR": 36,   # Low Drifting
-                    "MI": 12,   # Shallow
-                    "BC": 11,   # Patches
-                    "PR": 34,   # Partial
-                    "BL": 38,   # Blowing
-                    "VC": 36    # Vicinity
-                }
-
-                # Initialize weather1 and weather2 to empty strings in the special case handling
-                weather1 = ""
-                weather2 = ""
-
-                # Define the list of weather codes to check
-                weather_codes = list(weather_code_map.keys())
-
-                # Extract weather condition details if present
-                weather_match = re.findall(r"\b(" + "|".join(weather_codes) + r")\b", metar_line)
-                if weather_match:
-                    weather1 = weather_match[0]
-                    if len(weather_match) > 1:
-                        weather2 = weather_match[1]
-
-                # Define a function to map weather codes to WW values using the weather_code_map
-                def get_ww(weather1, weather2):
-                    ww = 999  # Default value if no match found
-                    if weather1 in weather_code_map:
-                        ww = weather_code_map[weather1]
-                    if weather2 in weather_code_map:
-                        ww = weather_code_map[weather2]  # If two weather conditions are found, use the second one
-                    return ww
-
-                # Assign WW column safely using the highest priority (lowest number)
-                codes_to_check = [weather1, weather2]
-                ww = min([weather_code_map.get(code, 999) for code in codes_to_check])
-
-                # Improved cloud condition handling
-                cloud_condition = weather1 if weather1 in ["OVC", "BKN", "SCT", "FEW", "SKC","NSC"] else weather2
-                cloud_condition = cloud_condition or ""  # Ensure it's always a string
-
-                temp = parse_temp(match.group(9))
-                dew_point = parse_temp(match.group(10))
-                qnh = int(match.group(11))
-                remarks = match.group(12) or ""
-
-                # Initialize cloud_condition to an empty string
-                cloud_condition = ""
-                # Extract cloud conditions if present
-                cloud_match = re.findall(r"\b(OVC|BKN|SCT|FEW|SKC|NSC)(?:\d{3})?\b", metar_line)
-                cloud_conditions = ["OVC", "BKN", "SCT", "FEW", "SKC","NSC"]
-                if cloud_match:
-
-                    # Check the cloud conditions in order of priority
-                    for condition in cloud_conditions:
-                        if condition in cloud_match:
-                            cloud_condition = condition
-                            break   # Stop once the highest priority condition is found
-
-                # Assign cloud cover safely
-                cloud_cover = 8 if "OVC" in cloud_condition else \
-                6 if "BKN" in cloud_condition else \
-                4 if "SCT" in cloud_condition else \
-                3 if "FEW" in cloud_condition else \
-                1 if "SKC" in cloud_condition else \
-                0 if "NSC" in cloud_condition else 999  # 999 if no matching condition
-
-                # RH Calculation (Avoid Division by Zero)
-                def saturation_vapor_pressure(temp):
-                    return 6.11 * 10 ** ((7.5 * temp) / (237.3 + temp))  
-
-                e_t = saturation_vapor_pressure(temp)
-                e_td = saturation_vapor_pressure(dew_point)
-                rh = round((e_td / e_t) * 100) if e_t != 0 else 0
-
-                # Calculate QFE
-                height = 70  
-                qfe = round(qnh * math.exp(-height / (29.3 * (temp + 273.15))))
-
-                # Additional calculations
-                low_visibility_indicator = int(visibility < 1500)
-                daylight_indicator = int(6 <= adjusted_time.hour < 18)
-                dew_point_depression = temp - dew_point
-
-                # Wind components
-                wind_direction_deg = 999 if wind_direction == "VRB" else int(wind_direction)
-                u = -wind_speed * np.sin(np.radians(wind_direction_deg))
-                v = -wind_speed * np.cos(np.radians(wind_direction_deg))
-                wx = u * np.cos(np.radians(wind_direction_deg))
-                wy = v * np.sin(np.radians(wind_direction_deg))
-
-                data_list.append({
-                    "DATETIME": formatted_datetime,
-                    "YEAR": year,
-                    "MONTH": month,
-                    "DD": adjusted_time.day,
-                    "GGGG": time_24hr,
-                    "DDD": wind_direction,
-                    "FF": wind_speed,
-                    "VV": visibility,
-                    "WW": ww,
-                    "N": cloud_cover,
-                    "TTT": temp,
-                    "TDTD": dew_point,
-                    "RH": rh,
-                    "QFE": qfe,
-                    "QNH": qnh,
-                    "U": u,
-                    "V": v,
-                    "Wx": wx,
-                    "Wy": wy,
-                    "Low_Visibility_Indicator": low_visibility_indicator,
-                    "Daylight_Indicator": daylight_indicator,
-                    "Dew_Point_Depression": dew_point_depression,
-                    "Remark": remarks
-                })
-            else:
-                unmatched_metars.append(metar_line)
-                print(f"Handling special case for: {metar_line}")
-                # Extract wind direction (DDD)
-                wind_match = re.search(r"(VRB|\d{3})(\d{2})G?(\d{2})?KT", metar_line) #r"(VRB|\d{3})(\d{2})KT(?:G(\d{2})KT)?" #(\d{3})(\d{2})G?(\d{2})?\D*KT" 
-
-                if wind_match:
-                    wind_direction = (wind_match.group(1))
-                    wind_speed = int(wind_match.group(2))
-                    wind_gust = int(wind_match.group(3)) if wind_match.group(3) else 0
-                else:
-                    wind_direction, wind_speed, wind_gust = 999, 999, 0
-
-                visibility_match = re.search(r"\s(\d{4})\s", metar_line)
-                visibility = int(visibility_match.group(1)) if visibility_match else 999  
-
-                weather_code_map = {
-                    "BR": 10,   # Mist
-                    "HZ": 5,    # Haze
-                    "DU": 7,    # Widespread Dust
-                    "FU": 4,    # Smoke
-                    "BLDU": 9,  # Blowing Widespread Dust
-                    "DZ": 50,   # Drizzle
-                    "RA": 21,   # Rain
-                    "SN": 22,   # Snow
-                    "SG": 20,   # Snow Grains
-                    "IC": 15,   # Ice Crystals NN
-                    "PL": 79,   # Ice Pellets
-                    "GR": 27,   # Hail
-                    "GS": 87,   # Small Hail and/or Snow Pellets
-                    "UP": 19,   # Unknown Precipitation NN
-                    "FG": 28,   # Fog
-                    "VA": 4,   # Volcanic Ash
-                    "SA": 22,   # Sand
-                    "SS": 23,   # Sandstorm
-                    "DS": 24,   # Duststorm
-                    "PO": 8,   # Dust/Sand Whirls
-                    "SQ": 18,   # Squalls
-                    "FC": 19,   # Funnel Clouds
-                    "TS": 29,   # Thunderstorm
-                    "SH": 70,   # Showers
-                    "FZ": 24,   # Freezing
-                    "DR": 36,   # Low Drifting
-                    "MI": 12,   # Shallow
-                    "BC": 11,   # Patches
-                    "PR": 34,   # Partial
-                    "BL": 38,   # Blowing
-                    "VC": 36    # Vicinity
-                }
-
-                # Initialize weather1 and weather2 to empty strings in the special case handling
-                weather1 = ""
-                weather2 = ""
-
-                # Define the list of weather codes to check
-                weather_codes = list(weather_code_map.keys())
-
-                # Extract weather condition details if present
-                weather_match = re.findall(r"\b(" + "|".join(weather_codes) + r")\b", metar_line)
-                if weather_match:
-                    weather1 = weather_match[0]
-                    if len(weather_match) > 1:
-                        weather2 = weather_match[1]
-
-                # Define a function to map weather codes to WW values using the weather_code_map
-                def get_ww(weather1, weather2):
-                    ww = 999  # Default value if no match found
-                    if weather1 in weather_code_map:
-                        ww = weather_code_map[weather1]
-                    if weather2 in weather_code_map:
-                        ww = weather_code_map[weather2]  # If two weather conditions are found, use the second one
-                    return ww
-
-                # Assign WW column safely using the highest priority (lowest number)
-                codes_to_check = [weather1, weather2]
-                ww = min([weather_code_map.get(code, 999) for code in codes_to_check])
-
-
-                # Improved cloud condition handling
-                cloud_condition = weather1 if weather1 in ["SKC", "FEW", "SCT", "BKN", "OVC","NSC"] else weather2
-                cloud_condition = cloud_condition or ""  # Ensure it's always a string
-
-
-                temp_match = re.search(r"(-?\d+|M\d+)/(-?\d+|M\d+)", metar_line)
-                if temp_match:
-                    temp = parse_temp(temp_match.group(1))
-                    dew_point = parse_temp(temp_match.group(2))
-                else:
-                    temp, dew_point = 999, 999
-
-
-                # Extract QNH (Pressure)
-                qnh_match = re.search(r"Q(\d+)", metar_line)
-                qnh = int(qnh_match.group(1)) if qnh_match else 999
-
-                
-                # Initialize cloud_condition to an empty string
-                cloud_condition = ""
-                # Extract cloud conditions if present
-                cloud_match = re.findall(r"\b(OVC|BKN|SCT|FEW|SKC|NSC)(?:\d{3})?\b", metar_line)
-                cloud_conditions = ["OVC", "BKN", "SCT", "FEW", "SKC","NSC"]
-                if cloud_match:
-
-                    # Check the cloud conditions in order of priority
-                    for condition in cloud_conditions:
-                        if condition in cloud_match:
-                            cloud_condition = condition
-                            break   # Stop once the highest priority condition is found
-
-                # Assign cloud cover safely
-                cloud_cover = 8 if "OVC" in cloud_condition else \
-                6 if "BKN" in cloud_condition else \
-                4 if "SCT" in cloud_condition else \
-                3 if "FEW" in cloud_condition else \
-                1 if "SKC" in cloud_condition else \
-                0 if "NSC" in cloud_condition else 999  # 999 if no matching condition
-
-                
-                # RH Calculation (Avoid Division by Zero)
-                def saturation_vapor_pressure(temp):
-                    return 6.11 * 10 ** ((7.5 * temp) / (237.3 + temp))  
-
-                e_t = saturation_vapor_pressure(temp)
-                e_td = saturation_vapor_pressure(dew_point)
-                rh = round((e_td / e_t) * 100) if e_t != 0 else 0
-
-                # Calculate QFE
-                height = 70  
-                qfe = round(qnh * math.exp(-height / (29.3 * (temp + 273.15))))
-
-                # Additional calculations
-                low_visibility_indicator = int(visibility < 1500)
-                daylight_indicator = int(6 <= adjusted_time.hour < 18)
-                dew_point_depression = temp - dew_point
-
-                # Wind components
-                wind_direction_deg = 999 if wind_direction == "VRB" else int(wind_direction)
-                u = -wind_speed * np.sin(np.radians(wind_direction_deg))
-                v = -wind_speed * np.cos(np.radians(wind_direction_deg))
-                wx = u * np.cos(np.radians(wind_direction_deg))
-                wy = v * np.sin(np.radians(wind_direction_deg))
-
-                # Extract everything after QNH as Remarks
-                remarks_match = re.search(r"Q\d+\s*(.*)", metar_line)
-                remarks = remarks_match.group(1).strip() if remarks_match else ""
-
-                data_list.append({
-                    "DATETIME": formatted_datetime,
-                    "YEAR": year,
-                    "MONTH": month,
-                    "DD": adjusted_time.day,
-                    "GGGG": time_24hr,
-                    "DDD": wind_direction, 
-                    "FF": wind_speed,  
-                    # "GUST": wind_gust if wind_gust else 0,
-                    "VV": visibility,
-                    "WW": ww,
-                    "N": cloud_cover,
-                    "TTT": temp,
-                    "TDTD": dew_point,
-                    "RH": rh,
-                    "QFE": qfe,
-                    "QNH": qnh,  
-                    "U": u,
-                    "V": v,
-                    "Wx": wx,
-                    "Wy": wy,
-                    "Low_Visibility_Indicator": low_visibility_indicator,
-                    "Daylight_Indicator": daylight_indicator,
-                    "Dew_Point_Depression": dew_point_depression,
-                    "Remark": remarks 
-                })
-                    
-
-        # Create DataFrame
-        df_output = pd.DataFrame(data_list)
-        df_output.to_excel(output_file, index=False)
-        print(f"Data successfully extracted and saved to {output_file}")
-
-        if unmatched_metars:
-            df_unmatched = pd.DataFrame({"METAR": unmatched_metars})
-            df_unmatched.to_excel("unparsed_metars.xlsx", index=False)
-            print(f"Unparsed METARs saved to unparsed_metars.xlsx")
-
-
-
-if __name__ == "__main__":
-    print("Running METAR parser...")
-    parse_metar_data("METAR_VISR_data.xlsx", "METAR_VISR_data1.xlsx")
+import argparse
+import calendar
+import csv
+import importlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+
+class _LazyModule:
+    """Imports a module on first attribute access.
+
+    pandas and NumPy take most of this module's import time; decoding lines
+    (see the decode command) needs neither of them.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+
+# def parse_visibility(value):
+#     """Parses visibility value, ensuring it's a valid number."""
+#     if value.isdigit():
+#         return int(value)
+#     elif value in ['KT', 'MPS', 'VRB']:
+#         return 999  # For invalid visibility, return a default value (999)
+#     return int(value)  # Fallback for other valid formats
+# # def parse_wind(value):
+#     """Parses wind value, ensuring it's a valid number."""
+#     if value.isdigit():
+
+# Output columns, in the order they are written; Fog_Indicator is added after Remark so the
+# original DATETIME ... Remark layout is unchanged
+OUTPUT_COLUMNS = [
+    "STATION", "DATETIME", "YEAR", "MONTH", "DD", "GGGG", "DDD", "FF", "VV", "WW", "N", "TTT", "TDTD", "RH",
+    "QFE", "QNH", "U", "V", "Wx", "Wy", "Low_Visibility_Indicator", "Daylight_Indicator",
+    "Dew_Point_Depression", "Remark", "Fog_Indicator",
+]
+
+# Fields the decoder extracts from the report itself; the rest are derived over whole columns
+RAW_COLUMNS = [
+    "STATION", "DATETIME", "YEAR", "MONTH", "DD", "GGGG", "DDD", "FF", "VV", "WW", "N", "TTT", "TDTD", "QNH",
+    "Fog_Indicator", "Remark",
+]
+
+MetarRecord = namedtuple("MetarRecord", RAW_COLUMNS)
+
+# What the decoder reads from the line alone: DDHHMM parts instead of the assembled time
+MetarFields = namedtuple("MetarFields", ["STATION", "DAY", "HOUR", "MINUTE"] + RAW_COLUMNS[6:])
+
+# Per-station metadata: aerodrome elevation (m) for the QFE reduction and the local time offset
+Station = namedtuple("Station", ["elevation", "utc_offset"])
+
+# Typed output schema shared by every writer; DDD is in degrees with VRB as 999. Fields with a
+# fixed number of digits fit int16; temperatures and pressures can carry any digit count.
+# STATION and Remark are categoricals in memory and plain text in the files.
+OUTPUT_DTYPES = {
+    "DATETIME": "datetime64[ns]",
+    "YEAR": "int16", "MONTH": "int16", "DD": "int16",
+    "DDD": "int16", "FF": "int16", "VV": "int16", "WW": "int16", "N": "int16",
+    "TTT": "int32", "TDTD": "int32", "RH": "int32", "QFE": "int32", "QNH": "int32",
+    "U": "float64", "V": "float64", "Wx": "float64", "Wy": "float64",
+    "Low_Visibility_Indicator": "int16", "Daylight_Indicator": "int16",
+    "Dew_Point_Depression": "int32", "Fog_Indicator": "int16",
+}
+
+# Column buffer types for MetarFields (see FieldColumns); the text fields are pooled
+FIELD_DTYPES = {
+    "DAY": "int16", "HOUR": "int16", "MINUTE": "int16",
+    "DDD": "int16", "FF": "int16", "VV": "int16", "WW": "int16", "N": "int16",
+    "TTT": "int32", "TDTD": "int32", "QNH": "int32", "Fog_Indicator": "int16",
+}
+POOLED_FIELDS = ("STATION", "Remark")
+# Value range of each buffer type, for fields converted one report at a time
+INT_LIMITS = {"int16": (-2**15, 2**15 - 1), "int32": (-2**31, 2**31 - 1)}
+
+WEATHER_CODE_MAP = {
+    "BR": 10,   # Mist
+    "HZ": 5,    # Haze
+    "DU": 7,    # Widespread Dust
+    "FU": 4,    # Smoke
+    "BLDU": 9,  # Blowing Widespread Dust
+    "DZ": 50,   # Drizzle
+    "RA": 21,   # Rain
+    "SN": 22,   # Snow
+    "SG": 20,   # Snow Grains
+    "IC": 15,   # Ice Crystals NN
+    "PL": 79,   # Ice Pellets
+    "GR": 27,   # Hail
+    "GS": 87,   # Small Hail and/or Snow Pellets
+    "UP": 19,   # Unknown Precipitation NN
+    "FG": 28,   # Fog
+    "VA": 4,   # Volcanic Ash
+    "SA": 22,   # Sand
+    "SS": 23,   # Sandstorm
+    "DS": 24,   # Duststorm
+    "PO": 8,   # Dust/Sand Whirls
+    "SQ": 18,   # Squalls
+    "FC": 19,   # Funnel Clouds
+    "TS": 29,   # Thunderstorm
+    "SH": 70,   # Showers
+    "FZ": 24,   # Freezing
+    "DR": 36,   # Low Drifting
+    "MI": 12,   # Shallow
+    "BC": 11,   # Patches
+    "PR": 34,   # Partial
+    "BL": 38,   # Blowing
+    "VC": 36    # Vicinity
+}
+
+# Cloud amounts in order of priority, and the okta value written to N
+CLOUD_PRIORITY = ["OVC", "BKN", "SCT", "FEW", "SKC", "NSC"]
+CLOUD_COVER = {"OVC": 8, "BKN": 6, "SCT": 4, "FEW": 3, "SKC": 1, "NSC": 0}
+# Every cloud group the decoder counts: the amount alone or with a 3-digit height (not "BKN015CB")
+CLOUD_GROUPS = frozenset(list(CLOUD_COVER) + [f"{amount}{height:03d}" for amount in CLOUD_COVER for height in range(1000)])
+# Present-weather groups that report fog (intensity signs are not part of the word)
+FOG_GROUPS = frozenset(["FG", "MIFG", "BCFG", "PRFG", "FZFG", "VCFG"])
+
+RUNWAY_PLUS_PATTERN = re.compile(r"R\d{2}/P\d+")
+STATION_PATTERN = re.compile(r"METAR\s+(\w+)")
+
+# Group-level patterns for the tokenizer. Each one is applied once, to a single
+# group or at a known position, so decoding stays linear in the line length.
+TOKEN_PATTERN = re.compile(r"\S+")
+WORD_PATTERN = re.compile(r"\w+")
+DIGITS_PATTERN = re.compile(r"\d+")
+DATE_TIME_PATTERN = re.compile(r"(\d{6}Z)")
+# Station, time, wind and optional visibility; every part is fixed-width or ends at a space
+LAYOUT_HEAD_PATTERN = re.compile(r"METAR \w+ \d{6}Z (\d{3}|VRB)(\d{2})(?:G\d{2,3})?(?:KT|MPS|KMH) (?:(\d{4}) | )")
+LOOSE_WIND_PATTERN = re.compile(r"(VRB|\d{3})(\d{2})G?(\d{2})?KT")
+RVR_HEAD_PATTERN = re.compile(r"R\d{2}[LRC]?/P?M?")
+RVR_TAIL_PATTERN = re.compile(r"\d+(?:V\d+)?[UDN]?")
+NOT_WORD_OR_SPACE_PATTERN = re.compile(r"[^\w\s]")
+# Weather and cloud groups between visibility and temperature: words of 2+
+# characters separated by single spaces, optionally with one trailing space
+GROUP_RUN_PATTERN = re.compile(r"(?:\w{2,}(?:\s\w{2,})*\s?)?")
+GROUP_RUN_REST_PATTERN = re.compile(r"(?:\s\w{2,})*\s?")
+DEW_POINT_PATTERN = re.compile(r"-?\d+|M\d+")
+# Temp/dew point and QNH, then an optional variable wind group before the remarks
+TEMP_QNH_PATTERN = re.compile(r"(-?\d+|M\d+)/(-?\d+|M\d+) Q(\d+)(?:\s*\d{3}V\d{3})?\s*(.*)")
+REMARKS_TAIL_PATTERN = re.compile(r"\s*(.*)")
+
+# Input layout of the exported workbook, and the readers that understand it
+INPUT_COLUMNS = ["Timestamp", "METAR Data"]
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm", ".xls")
+DEFAULT_CHUNKSIZE = 50_000
+BATCHES_PER_WORKER = 4  # smaller batches keep the pool busy when some chunks are slower
+ARCHIVE_STAMP_PATTERN = re.compile(r"(\d{12})\s+")
+
+# Output writers are picked by extension; Excel shows DATETIME the way the old string column did
+OUTPUT_FORMAT_ALIASES = {"xlsm": "xlsx", "pq": "parquet", "arrow": "feather"}
+# Part file format for a partition directory named without an extension
+PARTITION_FORMAT = "parquet"
+EXCEL_DATETIME_FORMAT = "dd-mm-yyyy hh.mm"
+
+# Used for stations missing from the registry; the original data came from VISR (Srinagar)
+STATION_HEIGHT = 70
+DEFAULT_STATION = Station(STATION_HEIGHT, timedelta(hours=5, minutes=30))
+UTC_OFFSET_PATTERN = re.compile(r"([+-]?)(\d{1,2}):?(\d{2})")
+
+# "HH:MM" for every minute of the day, indexed by hour * 60 + minute
+CLOCK_LABELS = [f"{hour:02d}:{minute:02d}" for hour in range(24) for minute in range(60)]
+
+# Feature matrix export: every numeric output column as one fixed-dtype, row-major matrix.
+# STATION is stored as an index into the sidecar's station list; DATETIME goes to a separate
+# int64 file of minutes since 1970, since float32 cannot hold timestamps exactly.
+FEATURE_COLUMNS = ["STATION"] + [column for column in OUTPUT_DTYPES if column != "DATETIME"]
+FEATURE_DTYPE = "<f4"
+FEATURE_TIME_DTYPE = "<M8[m]"
+FEATURE_SCHEMA_SUFFIX = ".json"
+FEATURE_TIMES_SUFFIX = ".times"
+
+# Partitioned output: one directory per station, one per month below it
+PARTITION_PATH = os.path.join("{station}", "{year:04d}-{month:02d}")
+UNKNOWN_STATION = "UNKNOWN"
+
+MISSING = 999
+UNAVAILABLE_REMARK = "DATA UNAVAILABLE"
+
+
+def parse_temp(value):
+    """Parses temperature values, handling 'M' for negative values."""
+    if value.startswith("M"):
+        return -int(value[1:]) if value[1:] != "00" else 0  # Convert "M00" to 0
+    return int(value)
+
+def saturation_vapor_pressure(temp):
+    return 6.11 * 10 ** ((7.5 * temp) / (237.3 + temp))
+
+
+# Bump whenever decode_fields can return different fields for the same line; DecodeCache
+# files written by another version are emptied and filled again
+DECODER_VERSION = 1
+
+
+class MetarDecoder:
+    """Decodes single METAR lines into MetarRecord tuples of raw fields.
+
+    All patterns and lookup tables are built at import time, so one decoder
+    can be kept alive and reused for any number of reports.
+    """
+
+    def decode(self, metar_line, reference_timestamp, stations=None):
+        """Decodes one cleaned METAR line; the timestamp supplies year and month.
+
+        stations is the StationRegistry giving the report's UTC offset
+        (DEFAULT_REGISTRY when omitted).
+        """
+        return self.decode_report(metar_line, reference_timestamp, stations)[0]
+
+    def decode_report(self, metar_line, reference_timestamp, stations=None):
+        """Returns (record, matched); matched is False for special-case lines."""
+        fields, matched = self.decode_fields(metar_line)
+        return assemble_record(reference_timestamp, fields, stations), matched
+
+    def decode_fields(self, metar_line):
+        """Returns (MetarFields, matched) using the line alone, so results can be cached.
+
+        matched is True when the line has the full METAR layout (station, time,
+        wind, visibility, groups, temp/dew, QNH); otherwise each field comes
+        from the first group of its kind anywhere in the line.
+        """
+        # Ignore Rxx/Pxxxx if present
+        if "/P" in metar_line:
+            metar_line = RUNWAY_PLUS_PATTERN.sub("", metar_line)
+
+        # Extract date-time part
+        date_time_match = DATE_TIME_PATTERN.search(metar_line)
+        date_time_raw = date_time_match.group(1) if date_time_match else "999999Z"
+        station_match = STATION_PATTERN.match(metar_line)
+        report_time = (station_match.group(1) if station_match else "",
+                       int(date_time_raw[:2]), int(date_time_raw[2:4]), int(date_time_raw[4:6]))
+
+        # Handle "DATA UNAVAILABLE" case
+        if "DATA UNAVAILABLE" in metar_line:
+            logger.debug("Filling missing data for: %s", metar_line)
+            return MetarFields(*report_time, *([MISSING] * 9), UNAVAILABLE_REMARK), True
+
+        layout = self._match_layout(metar_line)
+        if layout is not None:
+            wind_direction, wind_speed, visibility, temp_qnh = layout
+            temp = parse_temp(temp_qnh.group(1))
+            dew_point = parse_temp(temp_qnh.group(2))
+            qnh = int(temp_qnh.group(3))
+            remarks = temp_qnh.group(4)
+            remarks_start = temp_qnh.start(4)
+        else:
+            logger.debug("Handling special case for: %s", metar_line)
+            wind_match, visibility, temperature, qnh_at = _first_groups(metar_line)
+            if wind_match:
+                wind_direction = wind_match.group(1)
+                wind_speed = int(wind_match.group(2))
+            else:
+                wind_direction, wind_speed = MISSING, MISSING
+
+            if temperature:
+                temp = parse_temp(temperature[0])
+                dew_point = parse_temp(temperature[1])
+            else:
+                temp, dew_point = MISSING, MISSING
+
+            # QNH (Pressure), and everything after it as Remarks
+            if qnh_at is not None:
+                qnh_match = DIGITS_PATTERN.match(metar_line, qnh_at + 1)
+                qnh = int(qnh_match.group())
+                remarks_match = REMARKS_TAIL_PATTERN.match(metar_line, qnh_match.end())
+                remarks, remarks_start = remarks_match.group(1).strip(), remarks_match.start(1)
+            else:
+                qnh, remarks, remarks_start = MISSING, "", len(metar_line)
+
+        # Weather codes and cloud amounts are whole words anywhere in the line
+        words = WORD_PATTERN.findall(metar_line)
+        # Keep the first two weather codes, WW is the highest priority (lowest number)
+        weather_codes = [WEATHER_CODE_MAP[word] for word in words if word in WEATHER_CODE_MAP]
+        ww = min(weather_codes[:2], default=MISSING)
+        # Fog in any present-weather group, whatever WW ended up as; trend remarks do not count
+        fog = "FG" in metar_line[:remarks_start] and not FOG_GROUPS.isdisjoint(
+            WORD_PATTERN.findall(metar_line, 0, remarks_start))
+
+        # Cloud cover from the highest priority cloud group present
+        clouds = {word[:3] for word in words if word in CLOUD_GROUPS}
+        cloud_condition = next((condition for condition in CLOUD_PRIORITY if condition in clouds), "")
+        cloud_cover = CLOUD_COVER.get(cloud_condition, MISSING)  # 999 if no matching condition
+
+        fields = MetarFields(
+            *report_time, wind_direction, wind_speed, visibility, ww, cloud_cover,
+            temp, dew_point, qnh, int(fog), remarks,
+        )
+        return fields, layout is not None
+
+    def _match_layout(self, line):
+        """Checks the full layout group by group.
+
+        Returns (wind direction, wind speed, visibility, temp/QNH/remarks match),
+        or None when the line has to go through the special case.
+        """
+        head = LAYOUT_HEAD_PATTERN.match(line)
+        if head is None:
+            return None
+        visibility = int(head.group(3)) if head.group(3) else MISSING
+        pos = head.end()
+
+        temp_qnh = None
+        runway = RVR_HEAD_PATTERN.match(line, pos)
+        if runway is not None:
+            temp_qnh = self._match_groups(line, runway.end(), after_runway=True)
+        if temp_qnh is None:
+            temp_qnh = self._match_groups(line, pos)
+        if temp_qnh is None:
+            return None
+        return head.group(1), int(head.group(2)), visibility, temp_qnh
+
+    def _match_groups(self, line, start, after_runway=False):
+        """Matches the weather/cloud run from start up to " TT/DD Qnnnn" and the rest of the line.
+
+        The temperature group is the first one containing a non-word character,
+        so it is located directly instead of by backtracking over the groups.
+        """
+        anchor = NOT_WORD_OR_SPACE_PATTERN.search(line, start)
+        if anchor is None:
+            return None
+        if line[anchor.start()] == "/":
+            # The temperature is the word in front of the slash
+            run_end = line.rfind(" ", start, anchor.start())
+        elif line[anchor.start()] == "-":
+            run_end = anchor.start() - 1
+        else:
+            return None
+
+        if run_end < start or line[run_end] != " ":
+            return None
+        temp_qnh = TEMP_QNH_PATTERN.match(line, run_end + 1)
+        if temp_qnh is None:
+            return None
+
+        if after_runway:
+            valid = _runway_tail_then_groups(line, start, run_end)
+        else:
+            valid = GROUP_RUN_PATTERN.fullmatch(line, start, run_end) is not None
+        return temp_qnh if valid else None
+
+
+def _runway_tail_then_groups(line, start, end):
+    """Matches the end of a runway group (digits, V digits, U/D/N, spaces) followed by a group run."""
+    first_word = WORD_PATTERN.match(line, start, end)
+    if first_word is None or not line[start].isdecimal():
+        return False
+
+    # The groups may start inside the first word, right after its leading digit
+    if len(first_word.group()) >= 3 and GROUP_RUN_REST_PATTERN.fullmatch(line, first_word.end(), end):
+        return True
+
+    if RVR_TAIL_PATTERN.fullmatch(line, start, first_word.end()) is None:
+        return False
+    groups_start = first_word.end()
+    while groups_start < end and line[groups_start].isspace():
+        groups_start += 1
+    return groups_start == end or GROUP_RUN_PATTERN.fullmatch(line, groups_start, end) is not None
+
+def _temperature_pair(token):
+    """Returns the first (temp, dew point) texts in a group such as "15/08", "M02/M05" or "-1/-3"."""
+    slash = token.find("/")
+    while slash != -1:
+        start = slash
+        while start > 0 and token[start - 1].isdecimal():
+            start -= 1
+        if start < slash:
+            if start > 0 and token[start - 1] in "-M":
+                start -= 1
+            dew_point = DEW_POINT_PATTERN.match(token, slash + 1)
+            if dew_point is not None:
+                return token[start:slash], dew_point.group()
+        slash = token.find("/", slash + 1)
+    return None
+
+def _first_groups(line):
+    """One pass over the groups of a special-case line.
+
+    Returns the first wind match, visibility, (temp, dew point) texts and the
+    position of the QNH "Q"; None (MISSING for visibility) where absent.
+    """
+    wind_match = temperature = qnh_at = None
+    visibility = None
+    line_end = len(line)
+    for group in TOKEN_PATTERN.finditer(line):
+        token = group.group()
+        if wind_match is None and "KT" in token:
+            wind_match = LOOSE_WIND_PATTERN.search(token)
+        # A 4-digit group counts as visibility only with whitespace on both sides
+        if visibility is None and len(token) == 4 and token.isdecimal() and 0 < group.start() and group.end() < line_end:
+            visibility = int(token)
+        if temperature is None and "/" in token:
+            temperature = _temperature_pair(token)
+        if qnh_at is None and "Q" in token:
+            index = token.find("Q")
+            while index != -1 and not token[index + 1:index + 2].isdecimal():
+                index = token.find("Q", index + 1)
+            if index != -1:
+                qnh_at = group.start() + index
+    return wind_match, visibility if visibility is not None else MISSING, temperature, qnh_at
+
+
+def _parse_utc_offset(value):
+    """Reads a UTC offset given as "+05:30", "-0300" or a number of hours."""
+    if isinstance(value, timedelta):
+        return value
+    text = str(value).strip()
+    offset_match = UTC_OFFSET_PATTERN.fullmatch(text)
+    if offset_match:
+        sign = -1 if offset_match.group(1) == "-" else 1
+        return sign * timedelta(hours=int(offset_match.group(2)), minutes=int(offset_match.group(3)))
+    return timedelta(hours=float(text))
+
+
+class StationRegistry:
+    """ICAO code -> Station(elevation, utc_offset), loaded once per run.
+
+    Codes that are not registered get the default station; they are
+    collected in unknown so a run can report them (unless collect_unknown
+    is False, as for the long-lived DEFAULT_REGISTRY).
+    """
+
+    def __init__(self, stations=None, default=DEFAULT_STATION, collect_unknown=True):
+        self.stations = dict(stations if stations is not None else {"VISR": DEFAULT_STATION})
+        self.default = default
+        self.collect_unknown = collect_unknown
+        self.unknown = set()
+
+    @classmethod
+    def from_csv(cls, path, default=DEFAULT_STATION):
+        """Loads a CSV with ICAO, ELEVATION (metres) and UTC_OFFSET ("+05:30" or hours) columns."""
+        table = pd.read_csv(path, dtype={"ICAO": str, "UTC_OFFSET": str})
+        stations = {
+            icao.strip().upper(): Station(float(elevation), _parse_utc_offset(utc_offset))
+            for icao, elevation, utc_offset in table[["ICAO", "ELEVATION", "UTC_OFFSET"]].itertuples(index=False)
+        }
+        return cls(stations, default)
+
+    def get(self, icao):
+        station = self.stations.get(icao)
+        if station is None:
+            if self.collect_unknown:
+                self.unknown.add(icao)
+            return self.default
+        return station
+
+
+# Used when no registry is passed; shared by the whole process, so it does not collect unknown codes
+DEFAULT_REGISTRY = StationRegistry(collect_unknown=False)
+
+
+class FieldColumns:
+    """Growable typed column buffers for decoded MetarFields.
+
+    Numbers go into preallocated NumPy arrays (FIELD_DTYPES) that double
+    when full; STATION and Remark go into string pools, each distinct value
+    stored once with an int32 code per row. to_frame() wraps the buffers
+    without copying them. DDD is stored in degrees, with VRB as 999.
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(1, capacity)
+        self.size = 0
+        self.numbers = {name: np.empty(capacity, dtype) for name, dtype in FIELD_DTYPES.items()}
+        self.codes = {name: np.empty(capacity, np.int32) for name in POOLED_FIELDS}
+        self.pools = {name: {} for name in POOLED_FIELDS}
+
+    def _reserve(self, count):
+        capacity = len(self.codes["Remark"])
+        if self.size + count <= capacity:
+            return
+        while capacity < self.size + count:
+            capacity *= 2
+        for buffers in (self.numbers, self.codes):
+            for name, buffer in buffers.items():
+                grown = np.empty(capacity, buffer.dtype)
+                grown[:self.size] = buffer[:self.size]
+                buffers[name] = grown
+
+    def append(self, fields):
+        self.extend([fields])
+
+    def extend(self, fields):
+        """Appends a batch of MetarFields, converting one whole column at a time."""
+        fields = list(fields)
+        count = len(fields)
+        self._reserve(count)
+        start, end = self.size, self.size + count
+        # One pass per field; zip(*fields) builds the same columns but is much slower on large batches
+        columns = {name: list(map(itemgetter(i), fields)) for i, name in enumerate(MetarFields._fields)}
+
+        for name in POOLED_FIELDS:
+            pool = self.pools[name]
+            self.codes[name][start:end] = [pool.setdefault(value, len(pool)) for value in columns[name]]
+        for name, buffer in self.numbers.items():
+            values = columns[name]
+            if name == "DDD":
+                values = [MISSING if value == "VRB" else int(value) for value in values]
+            try:
+                buffer[start:end] = values
+            except OverflowError:
+                # Only possible for malformed digit runs: treat them as missing
+                limits = np.iinfo(buffer.dtype)
+                buffer[start:end] = [value if limits.min <= value <= limits.max else MISSING for value in values]
+        self.size = end
+
+    def to_frame(self):
+        columns = {}
+        for name in MetarFields._fields:
+            if name in self.pools:
+                columns[name] = pd.Categorical.from_codes(self.codes[name][:self.size], list(self.pools[name]))
+            else:
+                columns[name] = self.numbers[name][:self.size]
+        return pd.DataFrame(columns, copy=False)
+
+
+def _typed_fields(fields):
+    """One report's MetarFields as FieldColumns stores them: DDD in degrees, out-of-range values as 999."""
+    values = []
+    for name, value in zip(MetarFields._fields, fields):
+        if name in FIELD_DTYPES:
+            if name == "DDD":
+                value = MISSING if value == "VRB" else int(value)
+            low, high = INT_LIMITS[FIELD_DTYPES[name]]
+            value = value if low <= value <= high else MISSING
+        values.append(value)
+    return values
+
+def assemble_record(reference_timestamp, fields, stations=None):
+    """Combines one report's MetarFields with its reference timestamp into a MetarRecord.
+
+    Follows assemble_frame on plain Python values: DATETIME is a datetime
+    (None when DDHHMM is no valid time, with DD 999 and GGGG ""), and the
+    numeric fields are ints with DDD in degrees.
+    """
+    year, month = reference_timestamp.year, reference_timestamp.month
+    if fields.DAY > calendar.monthrange(year, month)[1] or fields.DAY > reference_timestamp.day + 1:
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    valid = 1 <= fields.DAY <= calendar.monthrange(year, month)[1] and fields.HOUR < 24 and fields.MINUTE < 60
+
+    values = _typed_fields(fields)[4:]
+    if not valid:
+        return MetarRecord(fields.STATION, None, reference_timestamp.year, reference_timestamp.month,
+                           MISSING, "", *values)
+    station = (stations or DEFAULT_REGISTRY).get(fields.STATION)
+    local = datetime(year, month, fields.DAY, fields.HOUR, fields.MINUTE) + station.utc_offset
+    return MetarRecord(fields.STATION, local, reference_timestamp.year, reference_timestamp.month,
+                       local.day, local.strftime("%H:%M"), *values)
+
+def assemble_frame(timestamps, fields, stats=None, stations=None):
+    """Combines reference timestamps and decoded MetarFields into a frame of RAW_COLUMNS.
+
+    fields is a FieldColumns or any sequence of MetarFields.
+
+    The report's DDHHMM is placed in the month of its reference timestamp,
+    or in the month before when that day does not exist in the month or is
+    more than a day after the reference (a report from the end of the
+    previous month). It is then shifted to the station's local time. All of
+    it is done over whole columns; a DDHHMM that is no valid time gives NaT.
+    """
+    if not isinstance(fields, FieldColumns):
+        buffers = FieldColumns(len(fields))
+        buffers.extend(fields)
+        fields = buffers
+    df = fields.to_frame()
+    reference = pd.DatetimeIndex(list(timestamps))
+    day = df["DAY"].to_numpy(dtype=np.int64)
+    minute_of_day = df["HOUR"].to_numpy(dtype=np.int64) * 60 + df["MINUTE"].to_numpy(dtype=np.int64)
+    stations = stations or DEFAULT_REGISTRY
+    utc_offset = _per_station(df["STATION"], lambda code: stations.get(code).utc_offset // timedelta(minutes=1))
+
+    months = reference.to_numpy().astype("datetime64[M]")
+    rolled = (day > _days_in_month(months)) | (day > reference.day.to_numpy() + 1)
+    months = months - rolled.astype(np.int64).astype("timedelta64[M]")
+    valid = (day >= 1) & (day <= _days_in_month(months)) & (df["HOUR"].to_numpy() < 24) & (df["MINUTE"].to_numpy() < 60)
+    if stats is not None:
+        stats.count("date_corrected", int((rolled & valid).sum()))
+
+    minutes = (day - 1) * 1440 + minute_of_day + utc_offset
+    local = months.astype("datetime64[m]") + np.where(valid, minutes, 0).astype("timedelta64[m]")
+    local_days = local.astype("datetime64[D]")
+    local_minute_of_day = (local - local_days).astype(np.int64)
+
+    columns = {
+        "STATION": df["STATION"],
+        "DATETIME": np.where(valid, local, np.datetime64("NaT")).astype("datetime64[ns]"),
+        "YEAR": reference.year.to_numpy(),
+        "MONTH": reference.month.to_numpy(),
+        "DD": np.where(valid, (local_days - local.astype("datetime64[M]")).astype(np.int64) + 1, MISSING),
+        "GGGG": np.where(valid, np.array(CLOCK_LABELS, dtype=object)[local_minute_of_day], ""),
+    }
+    for column in RAW_COLUMNS[6:]:
+        columns[column] = df[column]
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+def _per_station(station_column, value):
+    """Evaluates value(code) once per distinct station and spreads it over the rows."""
+    codes, uniques = pd.factorize(station_column)
+    return np.array([value(code) for code in uniques], dtype=np.int64 if len(uniques) == 0 else None)[codes]
+
+def _days_in_month(months):
+    return ((months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64)
+
+
+def derive_fields(df, stations=None):
+    """Adds RH, QFE, wind components and indicators to a frame of decoded raw fields.
+
+    Everything is computed over whole columns, with each row's elevation taken
+    from the station registry; "DATA UNAVAILABLE" rows get 999
+    in every derived column, VRB winds use 999 degrees as before. The result
+    carries the typed output schema (OUTPUT_DTYPES, real datetimes in DATETIME)
+    and shares the raw columns with df instead of copying them.
+    """
+    unavailable = (df["Remark"] == UNAVAILABLE_REMARK).to_numpy()
+    temp = df["TTT"].to_numpy(dtype=np.int64)
+    dew_point = df["TDTD"].to_numpy(dtype=np.int64)
+    qnh = df["QNH"].to_numpy(dtype=np.int64)
+    visibility = df["VV"].to_numpy(dtype=np.int64)
+    wind_speed = df["FF"].to_numpy(dtype=np.int64)
+    local_time = pd.to_datetime(df["DATETIME"])
+    hour = local_time.dt.hour.fillna(-1).to_numpy(dtype=np.int64)
+    stations = stations or DEFAULT_REGISTRY
+    elevation = _per_station(df["STATION"], lambda code: stations.get(code).elevation).astype(np.float64)
+
+    # RH Calculation (Avoid Division by Zero)
+    # Temperatures near -237.3 (only in malformed reports) overflow; _as_output_int turns those into 999
+    with np.errstate(over="ignore", invalid="ignore"):
+        e_t = saturation_vapor_pressure(temp)
+        e_td = saturation_vapor_pressure(dew_point)
+        ratio = np.divide(e_td, e_t, out=np.zeros_like(e_t), where=e_t != 0)
+        rh = np.where(e_t != 0, np.rint(ratio * 100), 0)
+
+    # Calculate QFE
+    qfe = np.rint(qnh * np.exp(-elevation / (29.3 * (temp + 273.15))))
+
+    # Additional calculations
+    low_visibility_indicator = (visibility < 1500).astype(np.int64)
+    daylight_indicator = np.where(hour < 0, MISSING, (6 <= hour) & (hour < 18)).astype(np.int64)
+    dew_point_depression = temp - dew_point
+
+    # Wind components (VRB is already 999 degrees)
+    wind_direction_deg = df["DDD"].to_numpy(dtype=np.int64)
+    radians = np.radians(wind_direction_deg)
+    u = -wind_speed * np.sin(radians)
+    v = -wind_speed * np.cos(radians)
+    wx = u * np.cos(radians)
+    wy = v * np.sin(radians)
+
+    derived = {
+        "RH": rh, "QFE": qfe, "U": u, "V": v, "Wx": wx, "Wy": wy,
+        "Low_Visibility_Indicator": low_visibility_indicator,
+        "Daylight_Indicator": daylight_indicator,
+        "Dew_Point_Depression": dew_point_depression,
+    }
+    columns = {column: df[column] for column in df.columns}
+    for column, values in derived.items():
+        values = np.where(unavailable, MISSING, values)
+        dtype = OUTPUT_DTYPES[column]
+        columns[column] = _as_output_int(values, dtype) if dtype in INT_LIMITS else values.astype(dtype)
+    columns["DATETIME"] = local_time
+    return pd.DataFrame({column: columns[column] for column in OUTPUT_COLUMNS}, copy=False).astype(OUTPUT_DTYPES)
+
+
+def _as_output_int(values, dtype):
+    """Casts derived values to an integer output type; non-finite or out-of-range values become 999.
+
+    Malformed temperatures can make RH or QFE overflow, which a plain cast would wrap around.
+    """
+    low, high = INT_LIMITS[dtype]
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        in_range = np.isfinite(values) & (values >= low) & (values <= high)
+    return np.where(in_range, values, MISSING).astype(dtype)
+
+
+class ParseStats:
+    """Row counters and per-stage timings for a parse run.
+
+    on_stage(stage, seconds) is called every time a stage finishes a chunk.
+    Decode time is split into "decode_fast" (full METAR layout) and
+    "decode_fallback" (special-case branch); with workers it is summed over
+    the pool, so it can exceed the wall-clock time. date_corrected counts
+    reports placed in the month before their reference timestamp.
+    """
+
+    COUNTERS = ("rows", "matched", "fallback", "unavailable", "date_corrected", "cache_hits", "cache_misses")
+
+    def __init__(self, on_stage=None):
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.timings = {}
+        self.on_stage = on_stage
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        if self.on_stage is not None:
+            self.on_stage(stage, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def as_dict(self):
+        return {**self.counts, **{f"{stage}_s": seconds for stage, seconds in self.timings.items()}}
+
+    def __repr__(self):
+        counts = ", ".join(f"{name}={value}" for name, value in self.counts.items())
+        timings = ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in self.timings.items())
+        return f"ParseStats({counts}; {timings})"
+
+
+def decode_fields_timed(decoder, metar_lines):
+    """Decodes line fields, returning (decoded, fast path seconds, fallback path seconds)."""
+    decoded = []
+    fast_seconds = fallback_seconds = 0.0
+    clock = time.perf_counter
+    for metar_line in metar_lines:
+        start = clock()
+        result = decoder.decode_fields(metar_line)
+        if result[1]:
+            fast_seconds += clock() - start
+        else:
+            fallback_seconds += clock() - start
+        decoded.append(result)
+    return decoded, fast_seconds, fallback_seconds
+
+def _record_decode_times(stats, fast_seconds, fallback_seconds):
+    if stats is not None:
+        stats.add_time("decode_fast", fast_seconds)
+        stats.add_time("decode_fallback", fallback_seconds)
+
+def decode_lines(metar_lines, decoder=None, cache=None, decode_many=None, stats=None, stations=None):
+    """Decodes (timestamp, cleaned line) pairs into the output frame.
+
+    decode_many(lines) replaces the serial field decoding (see _decoding); with
+    a DecodeCache only lines it has not seen for that month are decoded.
+    Returns (df_output, unmatched_metars).
+    """
+    decoder = decoder or MetarDecoder()
+    if decode_many is None:
+        def decode_many(lines):
+            decoded, fast_seconds, fallback_seconds = decode_fields_timed(decoder, lines)
+            _record_decode_times(stats, fast_seconds, fallback_seconds)
+            return decoded
+
+    if cache is not None:
+        decoded = cache.resolve(metar_lines, decode_many)
+    else:
+        decoded = decode_many([metar_line for _, metar_line in metar_lines])
+
+    with stats.timer("derive") if stats is not None else nullcontext():
+        return build_output(metar_lines, decoded, stats, stations)
+
+def build_output(metar_lines, decoded, stats=None, stations=None):
+    """Applies the reference timestamps to decoded fields and derives the output frame.
+
+    decoded holds one (fields, matched) pair per input pair.
+    Returns (df_output, unmatched_metars).
+    """
+    unmatched_metars = [RUNWAY_PLUS_PATTERN.sub("", metar_line)
+                        for (_, metar_line), (_, matched) in zip(metar_lines, decoded) if not matched]
+    buffers = FieldColumns(len(decoded))
+    buffers.extend(fields for fields, _ in decoded)
+    df_raw = assemble_frame([timestamp for timestamp, _ in metar_lines], buffers, stats, stations)
+    if stats is not None:
+        unavailable = int((df_raw["Remark"] == UNAVAILABLE_REMARK).sum())
+        stats.count("rows", len(df_raw))
+        stats.count("fallback", len(unmatched_metars))
+        stats.count("unavailable", unavailable)
+        stats.count("matched", len(df_raw) - len(unmatched_metars) - unavailable)
+    return derive_fields(df_raw, stations), unmatched_metars
+
+
+class DecodeCache:
+    """SQLite store of decoded fields keyed by the raw line and its reference month.
+
+    Repeated runs over a growing archive only decode lines that are new or
+    changed; hits and misses are counted across calls. The file records the
+    DECODER_VERSION it was filled with (SQLite user_version); a cache from
+    another version is cleared on open, so decoder changes never serve stale fields.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS decoded ("
+            " line TEXT NOT NULL, month TEXT NOT NULL, fields TEXT NOT NULL, matched INTEGER NOT NULL,"
+            " PRIMARY KEY (line, month)) WITHOUT ROWID"
+        )
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != DECODER_VERSION:
+            with self.connection:
+                self.connection.execute("DELETE FROM decoded")
+            self.connection.execute(f"PRAGMA user_version = {DECODER_VERSION}")
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, metar_lines, decode_many):
+        """Returns (fields, matched) per pair, decoding and storing the cache misses."""
+        keys = [(metar_line, f"{timestamp.year:04d}-{timestamp.month:02d}") for timestamp, metar_line in metar_lines]
+        unique_keys = list(dict.fromkeys(keys))
+
+        found = {}
+        for key in unique_keys:
+            row = self.connection.execute(
+                "SELECT fields, matched FROM decoded WHERE line = ? AND month = ?", key
+            ).fetchone()
+            # Rows stored before a field was added to MetarFields are decoded again
+            if row is not None and len(json.loads(row[0])) == len(MetarFields._fields):
+                found[key] = (MetarFields(*json.loads(row[0])), bool(row[1]))
+
+        missing = [key for key in unique_keys if key not in found]
+        if missing:
+            decoded = decode_many([metar_line for metar_line, _ in missing])
+            found.update(zip(missing, decoded))
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO decoded (line, month, fields, matched) VALUES (?, ?, ?, ?)",
+                    [(line, month, json.dumps(fields), int(matched))
+                     for (line, month), (fields, matched) in zip(missing, decoded)],
+                )
+
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        return [found[key] for key in keys]
+
+    def close(self):
+        self.connection.close()
+
+
+def clean_metar(value):
+    """Strips the "METAR:" export prefix from a raw cell; missing cells become ""."""
+    if not isinstance(value, str):
+        if pd.isnull(value):
+            return ""
+        value = str(value)
+    return re.sub(r"\s*METAR:\s*", "", value).strip()
+
+def _prepare_chunk(df_input):
+    """Turns a frame with Timestamp / METAR Data columns into (timestamp, line) pairs."""
+    df_input['Timestamp'] = pd.to_datetime(df_input['Timestamp'])  # Ensures it’s datetime format
+
+    df_input['Timestamp'] = pd.to_datetime(df_input['Timestamp'], format='%d-%m-%Y %I.%M.%S %p', errors='coerce')
+
+    # Clean METAR Data
+    df_input['Cleaned_METAR'] = df_input['METAR Data'].apply(clean_metar)
+
+    return df_input[['Timestamp', 'Cleaned_METAR']].dropna().values.tolist()
+
+def _iter_excel_rows(input_file):
+    """Yields the data rows of the first sheet as dicts, without loading the workbook."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(input_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        for values in rows:
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+def _iter_text_rows(input_file, reference_timestamp=None):
+    """Yields rows from a plain-text archive, one METAR per line.
+
+    Lines may start with an Ogimet-style YYYYMMDDHHMM stamp; lines without one
+    use reference_timestamp for their year and month and are skipped if none is given.
+    """
+    if reference_timestamp is not None:
+        # Only the month is known, so reference its last day: no report reads as "after" it
+        reference_timestamp = pd.Timestamp(reference_timestamp).to_period("M").end_time.floor("min")
+    with open(input_file, encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            stamp_match = ARCHIVE_STAMP_PATTERN.match(line)
+            if stamp_match:
+                yield {"Timestamp": datetime.strptime(stamp_match.group(1), "%Y%m%d%H%M"),
+                       "METAR Data": line[stamp_match.end():]}
+            elif reference_timestamp is not None:
+                yield {"Timestamp": reference_timestamp, "METAR Data": line}
+
+def _batched(rows, chunksize):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunksize:
+            yield pd.DataFrame(chunk, columns=INPUT_COLUMNS)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=INPUT_COLUMNS)
+
+def _read_whole(reader, input_file):
+    # Deferred so the read is timed together with the chunked readers
+    yield reader(input_file)
+
+def read_metar_chunks(input_file, chunksize=None, reference_timestamp=None, stats=None):
+    """Yields lists of (timestamp, cleaned line) pairs from an Excel, CSV or text archive.
+
+    With chunksize=None the whole input is read in one go; otherwise at most
+    chunksize rows are held in memory at a time.
+    """
+    extension = os.path.splitext(str(input_file))[1].lower()
+
+    if extension in EXCEL_EXTENSIONS:
+        if chunksize is None or extension == ".xls":
+            frames = _read_whole(pd.read_excel, input_file)
+        else:
+            frames = _batched(_iter_excel_rows(input_file), chunksize)
+    elif extension == ".csv":
+        if chunksize is None:
+            frames = _read_whole(pd.read_csv, input_file)
+        else:
+            frames = pd.read_csv(input_file, chunksize=chunksize)
+    else:
+        frames = _batched(_iter_text_rows(input_file, reference_timestamp), chunksize or DEFAULT_CHUNKSIZE)
+
+    frames = iter(frames)
+    while True:
+        with stats.timer("read") if stats is not None else nullcontext():
+            df_input = next(frames, None)
+        if df_input is None:
+            return
+        with stats.timer("clean") if stats is not None else nullcontext():
+            metar_lines = _prepare_chunk(df_input)
+        yield metar_lines
+
+def decode_fields_batch(metar_lines):
+    """Process-pool task: decodes a batch of lines, returning decode_fields_timed() output."""
+    return decode_fields_timed(MetarDecoder(), metar_lines)
+
+def decode_fields_parallel(metar_lines, executor, workers, stats=None):
+    """Decodes line fields across a process pool; results keep the input order."""
+    batch_size = max(1, -(-len(metar_lines) // (workers * BATCHES_PER_WORKER)))
+    batches = [metar_lines[i:i + batch_size] for i in range(0, len(metar_lines), batch_size)]
+    decoded = []
+    for batch, fast_seconds, fallback_seconds in executor.map(decode_fields_batch, batches):
+        decoded.extend(batch)
+        _record_decode_times(stats, fast_seconds, fallback_seconds)
+    return decoded
+
+@contextmanager
+def _decoding(workers=None, cache=None, stats=None, mp_context=None, stations=None):
+    """Yields a decode(metar_lines) callable, backed by a process pool when workers > 1.
+
+    mp_context picks how the pool starts its processes (see ProcessPoolExecutor).
+    """
+    decoder = MetarDecoder()
+    if not workers or workers <= 1:
+        yield lambda metar_lines: decode_lines(metar_lines, decoder, cache, stats=stats, stations=stations)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor  # only pooled runs pay for multiprocessing
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        decode_many = lambda lines: decode_fields_parallel(lines, executor, workers, stats)
+        yield lambda metar_lines: decode_lines(metar_lines, decoder, cache, decode_many, stats, stations)
+
+def iter_decoded_chunks(input_file, chunksize=None, reference_timestamp=None, workers=None, cache=None,
+                        stats=None, stations=None):
+    """Streams (df_output, unmatched_metars) per chunk of the input."""
+    with _decoding(workers, cache, stats, stations=stations) as decode:
+        for metar_lines in read_metar_chunks(input_file, chunksize, reference_timestamp, stats):
+            yield decode(metar_lines)
+
+
+class ExcelAppender:
+    """Appends frames to a single-sheet workbook in openpyxl write-only mode."""
+
+    def __init__(self, path, columns):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(list(columns))
+
+    def append(self, df):
+        from openpyxl.cell import WriteOnlyCell
+
+        datetime_positions = [i for i, column in enumerate(df.columns)
+                              if pd.api.types.is_datetime64_any_dtype(df[column])]
+        for row in df.itertuples(index=False, name=None):
+            if datetime_positions:
+                row = list(row)
+                for i in datetime_positions:
+                    cell = WriteOnlyCell(self.sheet, value=None if pd.isna(row[i]) else row[i])
+                    cell.number_format = EXCEL_DATETIME_FORMAT
+                    row[i] = cell
+            self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class CsvAppender:
+    """Appends frames to a CSV file, writing the header once."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        pd.DataFrame(columns=list(columns)).to_csv(path, index=False)
+
+    def append(self, df):
+        df.to_csv(self.path, mode="a", header=False, index=False)
+
+    def close(self):
+        pass
+
+
+class ArrowAppender:
+    """Base for the pyarrow-backed writers; the schema is fixed by the first frame."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.schema = None
+        self.writer = None
+
+    def append(self, df):
+        import pyarrow as pa
+
+        if self.schema is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            # Categoricals are written as their values: each frame has its own categories
+            for i, field in enumerate(schema):
+                if pa.types.is_dictionary(field.type):
+                    schema = schema.set(i, field.with_type(field.type.value_type))
+            self.schema = schema
+            self.writer = self._open(self.schema)
+        self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is None:
+            # Nothing was appended: still leave a readable, empty file behind
+            self.append(pd.DataFrame(columns=self.columns))
+        self.writer.close()
+
+
+class ParquetAppender(ArrowAppender):
+    """Writes each appended frame as a Parquet row group."""
+
+    def _open(self, schema):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(self.path, schema)
+
+
+class FeatherAppender(ArrowAppender):
+    """Writes appended frames as record batches of a Feather (Arrow IPC) file."""
+
+    def _open(self, schema):
+        import pyarrow as pa
+
+        return pa.ipc.new_file(self.path, schema)
+
+
+class MatrixAppender:
+    """Appends frames to a memory-mappable feature matrix (FEATURE_COLUMNS, FEATURE_DTYPE).
+
+    The file holds only the raw rows and path + ".times" their DATETIME;
+    shape, columns and the station list go into the path + ".json" sidecar,
+    which is rewritten after every append so the rows written so far can be
+    opened (see FeatureMatrix).
+    Text columns other than STATION are not exported; columns beyond
+    OUTPUT_COLUMNS (such as temporal features) are added after FEATURE_COLUMNS.
+    """
+
+    def __init__(self, path, columns=OUTPUT_COLUMNS):
+        self.path = path
+        self.columns = FEATURE_COLUMNS + [column for column in columns if column not in OUTPUT_COLUMNS]
+        self.file = open(path, "wb")
+        self.times_file = open(path + FEATURE_TIMES_SUFFIX, "wb")
+        self.rows = 0
+        self.stations = {}
+        self._write_schema()
+
+    def append(self, df):
+        if df.empty:
+            return
+        matrix = np.empty((len(df), len(self.columns)), FEATURE_DTYPE)
+        matrix[:, 0] = _per_station(df["STATION"], lambda code: self.stations.setdefault(code, len(self.stations)))
+        for i, column in enumerate(self.columns[1:], start=1):
+            matrix[:, i] = df[column].to_numpy()
+        self.file.write(matrix.tobytes())
+        self.times_file.write(df["DATETIME"].to_numpy().astype(FEATURE_TIME_DTYPE).tobytes())
+        self.file.flush()
+        self.times_file.flush()
+        self.rows += len(df)
+        self._write_schema()
+
+    def _write_schema(self):
+        schema = {
+            "dtype": FEATURE_DTYPE,
+            "shape": [self.rows, len(self.columns)],
+            "columns": self.columns,
+            "time_dtype": FEATURE_TIME_DTYPE,
+            "stations": list(self.stations),
+            "missing": MISSING,
+        }
+        # Replace the sidecar in one step so readers never see half of it
+        partial = self.path + FEATURE_SCHEMA_SUFFIX + ".partial"
+        with open(partial, "w") as schema_file:
+            json.dump(schema, schema_file, indent=1)
+        os.replace(partial, self.path + FEATURE_SCHEMA_SUFFIX)
+
+    def close(self):
+        self.file.close()
+        self.times_file.close()
+
+
+OUTPUT_WRITERS = {
+    "xlsx": ExcelAppender,
+    "csv": CsvAppender,
+    "parquet": ParquetAppender,
+    "feather": FeatherAppender,
+    "matrix": MatrixAppender,
+}
+
+def output_format_for(path, output_format=None):
+    """Resolves the writer name from an explicit format or the file extension."""
+    output_format = (output_format or os.path.splitext(str(path))[1].lstrip(".")).lower()
+    output_format = OUTPUT_FORMAT_ALIASES.get(output_format, output_format)
+    if output_format not in OUTPUT_WRITERS:
+        raise ValueError(f"Unsupported output format {output_format!r} for {path}; "
+                         f"expected one of {', '.join(OUTPUT_WRITERS)}")
+    return output_format
+
+def open_appender(path, columns, output_format=None):
+    """Opens the incremental writer for path (xlsx, csv, parquet, feather or matrix)."""
+    return OUTPUT_WRITERS[output_format_for(path, output_format)](path, columns)
+
+def _output_files(path, output_format):
+    """The files a writer produces for path; the matrix sidecar comes last so it is replaced last."""
+    if output_format == "matrix":
+        return [path, path + FEATURE_TIMES_SUFFIX, path + FEATURE_SCHEMA_SUFFIX]
+    return [path]
+
+def _staged_path(path):
+    """Where output for path is written until the run that produces it succeeds."""
+    root, ext = os.path.splitext(str(path))
+    return f"{root}.partial{ext}"
+
+def _publish_staged(path, output_format, succeeded):
+    """Moves the staged files over path on success, otherwise deletes them and leaves path as it was."""
+    for final, partial in zip(_output_files(path, output_format),
+                              _output_files(_staged_path(path), output_format)):
+        if succeeded:
+            os.replace(partial, final)
+        elif os.path.exists(partial):
+            os.remove(partial)
+
+
+class PartitionedAppender:
+    """Writes output under path/<STATION>/<YYYY-MM>/, one part file per appended chunk.
+
+    Each partition only ever gains new part files, so partitions can be
+    written and re-read independently (see read_partition). The part format
+    is output_format, else the directory's extension, else PARTITION_FORMAT.
+    """
+
+    def __init__(self, path, columns, output_format=None):
+        self.path = path
+        self.columns = list(columns)
+        if output_format is None and not os.path.splitext(str(path))[1]:
+            output_format = PARTITION_FORMAT
+        self.output_format = output_format_for(path, output_format)
+        self.parts = {}
+        self.written = []
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, df):
+        # Reports without a valid time go to the month of their reference timestamp
+        months = (df["DATETIME"].dt.year * 100 + df["DATETIME"].dt.month).fillna(df["YEAR"] * 100 + df["MONTH"])
+        months = months.astype(np.int64)
+        for (station, month), part in df.groupby([df["STATION"], months], sort=False, observed=True):
+            directory = partition_path(self.path, station, month // 100, month % 100)
+            number = self.parts.get(directory, 0)
+            if number == 0:
+                os.makedirs(directory, exist_ok=True)
+                number = len(_part_files(directory, self.output_format))  # keep parts from earlier runs
+            part_path = os.path.join(directory, f"part-{number:05d}.{self.output_format}")
+            self.written.append(part_path)
+            part_writer = OUTPUT_WRITERS[self.output_format](part_path, self.columns)
+            part_writer.append(part)
+            part_writer.close()
+            self.parts[directory] = number + 1
+
+    def close(self):
+        pass
+
+    def discard(self):
+        """Deletes the part files written by this appender, leaving earlier runs' parts in place."""
+        for part_path in self.written:
+            for name in _output_files(part_path, self.output_format):
+                if os.path.exists(name):
+                    os.remove(name)
+        self.written = []
+        self.parts = {}
+
+def partition_path(path, station, year, month):
+    return os.path.join(path, PARTITION_PATH.format(station=station or UNKNOWN_STATION, year=year, month=month))
+
+def _part_files(directory, output_format):
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith("part-") and name.endswith("." + output_format))
+
+def read_output(path, output_format=None):
+    """Reads a file written by one of the OUTPUT_WRITERS back into a frame."""
+    output_format = output_format_for(path, output_format)
+    if output_format == "matrix":
+        return FeatureMatrix(path).to_frame()
+    if output_format == "csv":
+        return pd.read_csv(path, parse_dates=["DATETIME"], keep_default_na=False, na_values={"DATETIME": [""]})
+    df = {"xlsx": pd.read_excel, "parquet": pd.read_parquet, "feather": pd.read_feather}[output_format](path)
+    # Excel gives back empty text cells (a report without a station or remark) as NaN
+    return df.fillna({column: "" for column in POOLED_FIELDS if column in df.columns})
+
+def read_partition(path, station, year, month, output_format=None):
+    """Reads one station-month of a partitioned output back into a frame.
+
+    Without output_format, the format is taken from the partition's part files.
+    """
+    directory = partition_path(path, station, year, month)
+    if output_format is None:
+        parts = sorted(name for name in os.listdir(directory) if name.startswith("part-"))
+        output_format = os.path.splitext(parts[0])[1].lstrip(".") if parts else None
+    output_format = output_format_for(path, output_format)
+    return pd.concat([read_output(os.path.join(directory, part), output_format)
+                      for part in _part_files(directory, output_format)], ignore_index=True)
+
+
+class FeatureMatrix:
+    """Read-only, zero-copy view of a matrix written by MatrixAppender.
+
+    values is an np.memmap of shape (rows, len(columns)): nothing is read
+    until it is touched, and processes opening the same file share its pages
+    through the OS page cache. 999 marks missing values as in every output.
+    times is the matching datetime64[m] memmap of DATETIME (NaT where the
+    report had no valid time).
+
+    Example, visibility and fog label for a training run:
+        matrix = FeatureMatrix("features.matrix")
+        X = matrix.values[:, [matrix.columns.index(c) for c in ("RH", "Dew_Point_Depression", "U", "V")]]
+        y = matrix.column("Low_Visibility_Indicator")
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + FEATURE_SCHEMA_SUFFIX) as schema_file:
+            self.schema = json.load(schema_file)
+        self.columns = self.schema["columns"]
+        shape = tuple(self.schema["shape"])
+        dtype = np.dtype(self.schema["dtype"])
+        time_dtype = np.dtype(self.schema["time_dtype"])
+        # mmap cannot map zero bytes
+        if shape[0]:
+            self.values = np.memmap(path, dtype, mode="r", shape=shape)
+            self.times = np.memmap(path + FEATURE_TIMES_SUFFIX, time_dtype, mode="r", shape=shape[:1])
+        else:
+            self.values = np.empty(shape, dtype)
+            self.times = np.empty(0, time_dtype)
+
+    def column(self, name):
+        return self.values[:, self.columns.index(name)]
+
+    def stations(self):
+        """STATION codes per row."""
+        codes = np.array(self.schema["stations"], dtype=object)
+        return codes[self.column("STATION").astype(np.int64)]
+
+    def to_frame(self):
+        """Copies the matrix into a frame with the output dtypes (extra columns stay float)."""
+        columns = {"STATION": self.stations(), "DATETIME": self.times.astype("datetime64[ns]")}
+        for column in self.columns[1:]:
+            columns[column] = self.column(column).astype(OUTPUT_DTYPES.get(column, np.float64))
+        return pd.DataFrame(columns)
+
+
+def parse_metar_data(input_file, output_file, chunksize=None, reference_timestamp=None,
+                     unparsed_file="unparsed_metars.xlsx", workers=None, output_format=None,
+                     cache_path=None, stats=None, on_stage=None, stations=None, partition=False,
+                     features_file=None, temporal_features=None):
+    """Decodes a METAR archive into output_file and returns the run's ParseStats.
+
+    input_file may be an Excel export, a CSV with Timestamp / METAR Data columns
+    or a plain-text archive. Passing chunksize streams the input and appends
+    each decoded chunk to the outputs, so memory stays bounded by the chunk size.
+    workers > 1 decodes in a process pool; the output order is unchanged.
+    The output format comes from output_format or the output file extension.
+    cache_path enables incremental runs: decoded lines are kept in a SQLite
+    file and only new or changed lines are decoded again.
+    stations is a StationRegistry or the path of its CSV; elevation and UTC
+    offset are looked up per report. With partition=True output_file is a
+    directory holding one partition per station and month. features_file also
+    exports the numeric columns as a memory-mapped matrix (see FeatureMatrix).
+    temporal_features (e.g. metar_features.TemporalFeatures()) adds its
+    columns to each decoded chunk before it is written.
+    Outputs are written to "<name>.partial<ext>" files that replace the real
+    files only when the run succeeds; a failed run deletes them (with
+    partition=True, the part files it added) and leaves earlier output intact.
+    Per-report messages are logged at DEBUG and the run summary at INFO on
+    this module's logger; on_stage(stage, seconds) receives the stage timings.
+    """
+    stats = stats if stats is not None else ParseStats(on_stage)
+    if stations is None or isinstance(stations, (str, os.PathLike)):
+        stations = StationRegistry.from_csv(stations) if stations is not None else StationRegistry()
+    columns = OUTPUT_COLUMNS + (list(temporal_features.columns) if temporal_features is not None else [])
+    # Everything is written to staged paths and only replaces the real files once the run succeeds
+    staged = []
+    if partition:
+        writer = PartitionedAppender(output_file, columns, output_format)
+    else:
+        output_format = output_format_for(output_file, output_format)
+        writer = open_appender(_staged_path(output_file), columns, output_format)
+        staged.append((output_file, output_format))
+    features_writer = None
+    if features_file:
+        features_writer = MatrixAppender(_staged_path(features_file), columns)
+        staged.append((features_file, "matrix"))
+    unparsed_writer = None
+    cache = DecodeCache(cache_path) if cache_path else None
+    succeeded = False
+    try:
+        for df_output, unmatched_metars in iter_decoded_chunks(input_file, chunksize, reference_timestamp,
+                                                               workers, cache, stats, stations):
+            if temporal_features is not None:
+                with stats.timer("features"):
+                    df_output = temporal_features.update(df_output)
+            with stats.timer("write"):
+                writer.append(df_output)
+                if features_writer is not None:
+                    features_writer.append(df_output)
+                if unmatched_metars:
+                    if unparsed_writer is None:
+                        unparsed_format = output_format_for(unparsed_file)
+                        unparsed_writer = open_appender(_staged_path(unparsed_file), ["METAR"], unparsed_format)
+                        staged.append((unparsed_file, unparsed_format))
+                    unparsed_writer.append(pd.DataFrame({"METAR": unmatched_metars}))
+        succeeded = True
+    finally:
+        with stats.timer("write"):
+            writer.close()
+            if features_writer is not None:
+                features_writer.close()
+            if unparsed_writer is not None:
+                unparsed_writer.close()
+            for path, staged_format in staged:
+                _publish_staged(path, staged_format, succeeded)
+            if partition and not succeeded:
+                writer.discard()
+        if cache is not None:
+            stats.count("cache_hits", cache.hits)
+            stats.count("cache_misses", cache.misses)
+            cache.close()
+
+    if stations.unknown:
+        logger.warning("No station metadata for %s; used elevation %s m and UTC offset %s",
+                       ", ".join(sorted(code or "(none)" for code in stations.unknown)),
+                       stations.default.elevation, stations.default.utc_offset)
+    logger.info("Data successfully extracted and saved to %s", output_file)
+    if features_writer is not None:
+        logger.info("Feature matrix saved to %s", features_file)
+    if unparsed_writer is not None:
+        logger.info("Unparsed METARs saved to %s", unparsed_file)
+    logger.info("%s", stats)
+    return stats
+
+
+def decode_stream(lines, output, output_format="jsonl"):
+    """Decodes METAR lines into their raw fields (DDHHMM, no derived columns).
+
+    Writes one JSON object per report, or CSV rows, with a "matched" flag
+    that is false for special-case lines. DDD is in degrees (VRB as 999), as
+    in the output files. Needs neither pandas nor NumPy.
+    """
+    decoder = MetarDecoder()
+    columns = list(MetarFields._fields) + ["matched"]
+    writer = csv.writer(output) if output_format == "csv" else None
+    if writer is not None:
+        writer.writerow(columns)
+    for line in lines:
+        line = clean_metar(line)
+        if not line:
+            continue
+        fields, matched = decoder.decode_fields(line)
+        row = [*_typed_fields(fields), matched]
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            output.write(json.dumps(dict(zip(columns, row))) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode METAR archives or single reports.")
+    commands = parser.add_subparsers(dest="command")
+
+    parse = commands.add_parser("parse", help="decode an archive into an output file (the default command)")
+    parse.add_argument("input", nargs="?", default="METAR_VISR_data.xlsx",
+                       help="Excel export, CSV or plain-text archive")
+    parse.add_argument("output", nargs="?", default="METAR_VISR_data1.xlsx")
+    parse.add_argument("--format", choices=sorted(OUTPUT_WRITERS), default=None,
+                       help="output format (default: from the output extension)")
+    parse.add_argument("--workers", type=int, default=None)
+    parse.add_argument("--unparsed", default=None,
+                       help="file for special-case reports (default: unparsed_metars.xlsx next to the output)")
+    parse.add_argument("--chunksize", type=int, default=None)
+    parse.add_argument("--stations", default=None, help="station registry CSV (ICAO, ELEVATION, UTC_OFFSET)")
+    parse.add_argument("--cache", default=None, help="SQLite decode cache for incremental runs")
+    parse.add_argument("--partition", action="store_true",
+                       help=f"write one partition per station and month ({PARTITION_FORMAT} parts unless --format is given)")
+    parse.add_argument("--features-file", default=None, help="also export a memory-mapped feature matrix")
+    parse.add_argument("--temporal-features", action="store_true",
+                       help="add lag, rolling-window and fog persistence columns (see metar_features)")
+
+    decode = commands.add_parser("decode", help="decode METAR lines from stdin to stdout without pandas")
+    decode.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in ("parse", "decode", "-h", "--help"):
+        argv = ["parse"] + argv  # `time_changed.py [input output] [options]` as before
+    args = parser.parse_args(argv)
+
+    if args.command == "decode":
+        decode_stream(sys.stdin, sys.stdout, args.format)
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logger.info("Running METAR parser...")
+    unparsed_file = args.unparsed or os.path.join(os.path.dirname(args.output), "unparsed_metars.xlsx")
+    temporal_features = None
+    if args.temporal_features:
+        import metar_features
+
+        temporal_features = metar_features.TemporalFeatures()
+    parse_metar_data(args.input, args.output, chunksize=args.chunksize, unparsed_file=unparsed_file,
+                     workers=args.workers, output_format=args.format, cache_path=args.cache,
+                     stations=args.stations, partition=args.partition, features_file=args.features_file,
+                     temporal_features=temporal_features)
+
+
+if __name__ == "__main__":
+    main()